@@ -0,0 +1,177 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from .history import get_max_versions
+from .models import Message, MessageEditHistory, ArchivedMessage
+from .versions import bump_chat_version
+
+# Значения по умолчанию, если в settings ничего не задано
+DEFAULT_ARCHIVE_AFTER_DAYS = 365
+DEFAULT_PURGE_DELETED_AFTER_DAYS = 30
+DEFAULT_BATCH_SIZE = 1000
+
+
+def get_archive_after_days(chat):
+    """
+    Срок хранения сообщений чата в горячей таблице (в днях).
+    """
+    if chat.archive_after_days is not None:
+        return chat.archive_after_days
+    return getattr(settings, 'CHAT_ARCHIVE_AFTER_DAYS', DEFAULT_ARCHIVE_AFTER_DAYS)
+
+
+def get_purge_deleted_after_days():
+    """
+    Сколько дней хранить мягко удалённые сообщения перед окончательным удалением.
+    """
+    return getattr(settings, 'CHAT_PURGE_DELETED_AFTER_DAYS', DEFAULT_PURGE_DELETED_AFTER_DAYS)
+
+
+def delete_media_files(names):
+    """
+    Удаление медиафайлов из хранилища. Ошибки отдельных файлов не прерывают процесс.
+    """
+    for name in names:
+        if not name:
+            continue
+        try:
+            default_storage.delete(name)
+        except OSError:
+            pass
+
+
+def archive_chat_messages(chat, batch_size=DEFAULT_BATCH_SIZE, now=None):
+    """
+    Перенос сообщений чата старше срока хранения в архив.
+    Работает пачками, каждая пачка переносится в отдельной транзакции.
+    Возвращает количество перенесённых сообщений.
+    """
+    now = now or timezone.now()
+    cutoff = now - timedelta(days=get_archive_after_days(chat))
+    max_versions = get_max_versions()
+    archived = 0
+
+    while True:
+        batch = list(
+            Message.objects.filter(chat=chat, is_deleted=False, created_at__lt=cutoff)
+                           .order_by('id')
+                           .values('id', 'sender_id', 'text', 'media', 'created_at', 'updated_at')[:batch_size]
+        )
+        if not batch:
+            break
+        ids = [row['id'] for row in batch]
+
+        # История изменений всей пачки одним запросом
+        history = {}
+        for edit in (MessageEditHistory.objects.filter(message_id__in=ids)
+                                               .order_by('-edited_at')
+                                               .values('message_id', 'old_text', 'edited_by_id', 'edited_at')):
+            versions = history.setdefault(edit['message_id'], [])
+            # В архив попадают только версии в пределах лимита хранения
+            if max_versions and len(versions) >= max_versions:
+                continue
+            versions.append({
+                'old_text': edit['old_text'],
+                'edited_by': edit['edited_by_id'],
+                'edited_at': edit['edited_at'].isoformat(),
+            })
+
+        with transaction.atomic():
+            ArchivedMessage.objects.bulk_create([
+                ArchivedMessage(
+                    id=row['id'],
+                    chat_id=chat.id,
+                    sender_id=row['sender_id'],
+                    text=row['text'],
+                    media=row['media'] or '',
+                    created_at=row['created_at'],
+                    updated_at=row['updated_at'],
+                    edit_history=history.get(row['id'], []),
+                )
+                for row in batch
+            ], ignore_conflicts=True)
+            MessageEditHistory.objects.filter(message_id__in=ids).delete()
+            Message.objects.filter(id__in=ids).delete()
+            bump_chat_version(chat.id)
+
+        archived += len(ids)
+
+    return archived
+
+
+def purge_deleted_messages(batch_size=DEFAULT_BATCH_SIZE, now=None):
+    """
+    Окончательное удаление мягко удалённых сообщений после льготного периода.
+    Возвращает количество удалённых сообщений.
+    """
+    now = now or timezone.now()
+    cutoff = now - timedelta(days=get_purge_deleted_after_days())
+    purged = 0
+
+    while True:
+        batch = list(
+            Message.objects.filter(is_deleted=True, updated_at__lt=cutoff)
+                           .order_by('id')
+                           .values_list('id', 'chat_id', 'media')[:batch_size]
+        )
+        if not batch:
+            break
+        ids = [message_id for message_id, _, _ in batch]
+        media = [name for _, _, name in batch if name]
+
+        with transaction.atomic():
+            MessageEditHistory.objects.filter(message_id__in=ids).delete()
+            Message.objects.filter(id__in=ids).delete()
+            transaction.on_commit(lambda media=media: delete_media_files(media))
+            for chat_id in {chat_id for _, chat_id, _ in batch}:
+                bump_chat_version(chat_id)
+
+        purged += len(ids)
+
+    return purged
+
+
+def serialize_message(message, archived=False):
+    """
+    Представление сообщения в формате, который использует ChatConsumer.
+    """
+    if archived:
+        media_url = default_storage.url(message.media) if message.media else None
+    else:
+        media_url = message.media.url if message.media else None
+    return {
+        'message_id': message.id,
+        'sender': message.sender.username,
+        'text': message.text,
+        'media_url': media_url,
+        'created_at': message.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+        'archived': archived,
+    }
+
+
+def get_messages_before(chat, before_id=None, limit=50):
+    """
+    Страница истории чата до сообщения before_id (от новых к старым).
+    Сначала читается горячая таблица, недостающее добирается из архива.
+    """
+    hot = Message.objects.filter(chat=chat, is_deleted=False).select_related('sender')
+    if before_id is not None:
+        hot = hot.filter(id__lt=before_id)
+    page = [serialize_message(message) for message in hot.order_by('-id')[:limit]]
+
+    if len(page) < limit:
+        # Горячие сообщения до before_id закончились, дочитываем архив
+        cold = ArchivedMessage.objects.filter(chat=chat).select_related('sender')
+        if before_id is not None:
+            cold = cold.filter(id__lt=before_id)
+        page.extend(
+            serialize_message(message, archived=True)
+            for message in cold.order_by('-id')[:limit - len(page)]
+        )
+
+    return page
+
@@ -0,0 +1,43 @@
+from contextlib import contextmanager
+from itertools import islice
+
+from .models import Chat, Message, MessageEditHistory
+
+# Поля с auto_now/auto_now_add, которые при массовой загрузке нужно брать из данных
+TIMESTAMP_FIELDS = [
+    (Chat, 'created_at'),
+    (Message, 'created_at'),
+    (Message, 'updated_at'),
+    (MessageEditHistory, 'edited_at'),
+]
+
+
+@contextmanager
+def preserve_timestamps():
+    """
+    Временно отключает auto_now/auto_now_add, чтобы bulk_create сохранял переданные даты.
+    Предназначено только для management-команд.
+    """
+    saved = []
+    for model, name in TIMESTAMP_FIELDS:
+        field = model._meta.get_field(name)
+        saved.append((field, field.auto_now, field.auto_now_add))
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now = auto_now
+            field.auto_now_add = auto_now_add
+
+
+def batched(iterable, size):
+    """
+    Разбивает итерируемый объект на списки длиной не больше size.
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
@@ -3,14 +3,17 @@ import asyncio
 import base64
 import uuid
 from asgiref.sync import sync_to_async
+from channels.consumer import SyncConsumer
 from channels.generic.websocket import AsyncWebsocketConsumer
 from django.core.exceptions import PermissionDenied
 from .models import Chat, Message, MessageEditHistory
 
+from django.conf import settings
 from django.core.files.base import ContentFile
 from django.contrib.auth.models import User
 from django.core.exceptions import PermissionDenied
 from .models import Chat, Message, MessageEditHistory
+from .purge import purge_chat
 
 class ChatConsumer(AsyncWebsocketConsumer):
     def __init__(self, *args, **kwargs):
@@ -75,11 +78,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
     async def receive(self, text_data):
         try:
             data = json.loads(text_data)
-            handler = {
-                'chat_message': self.handle_new_message,
-                'edit_message': self.handle_edit_message,
-                'delete_message': self.handle_delete_message
-            }.get(data.get('type'))
+            handler = self.get_handlers().get(data.get('type'))
             
             if handler:
                 await handler(data)
@@ -88,25 +87,35 @@ class ChatConsumer(AsyncWebsocketConsumer):
         except Exception as e:
             await self.send_error(f"Processing error: {str(e)}")
 
+    def get_handlers(self):
+        """Обработчики сообщений клиента по полю type"""
+        return {
+            'chat_message': self.handle_new_message,
+            'edit_message': self.handle_edit_message,
+            'delete_message': self.handle_delete_message
+        }
+
     async def handle_new_message(self, data):
         """Обработка нового сообщения"""
+        chat_id = self.get_target_chat_id(data)
         text = data.get('text', '').strip()
         if not text and 'media' not in data:
             raise ValueError("Сообщение не может быть пустым")
 
         # Создание сообщения
         message = await sync_to_async(Message.objects.create)(
-            chat_id=self.chat_id,
-            sender=self.user,
+            chat_id=chat_id,
+            sender_id=self.user.id,
             text=text,
             media=data.get('media')
         )
 
         # Отправка всем участникам
         await self.channel_layer.group_send(
-            self.chat_group_name,
+            f'chat_{chat_id}',
             {
                 'type': 'chat_message',
+                'chat_id': int(chat_id),
                 'message_id': message.id,
                 'sender': self.user.username,
                 'text': message.text,
@@ -117,14 +126,15 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
     async def handle_edit_message(self, data):
         """Обработка редактирования сообщения"""
-        message = await self.get_message(data['message_id'])
+        chat_id = self.get_target_chat_id(data)
+        message = await self.get_message(data['message_id'], chat_id)
         await self.check_edit_permission(message)
 
         # Сохранение истории
         await sync_to_async(MessageEditHistory.objects.create)(
             message=message,
             old_text=message.text,
-            edited_by=self.user
+            edited_by_id=self.user.id
         )
 
         # Обновление сообщения
@@ -133,9 +143,10 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
         # Рассылка изменений
         await self.channel_layer.group_send(
-            self.chat_group_name,
+            f'chat_{chat_id}',
             {
                 'type': 'message_edited',
+                'chat_id': int(chat_id),
                 'message_id': message.id,
                 'new_text': message.text,
                 'edited_by': self.user.username,
@@ -145,48 +156,55 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
     async def handle_delete_message(self, data):
         """Обработка удаления сообщения"""
-        message = await self.get_message(data['message_id'])
+        chat_id = self.get_target_chat_id(data)
+        message = await self.get_message(data['message_id'], chat_id)
         await self.check_delete_permission(message)
 
         # Мягкое удаление
         message.is_deleted = True
-        message.deleted_by = self.user
+        message.deleted_by_id = self.user.id
         await sync_to_async(message.save)()
 
         # Уведомление участников
         await self.channel_layer.group_send(
-            self.chat_group_name,
+            f'chat_{chat_id}',
             {
                 'type': 'message_deleted',
+                'chat_id': int(chat_id),
                 'message_id': message.id,
                 'deleted_by': self.user.username
             }
         )
 
     # Вспомогательные методы
-    async def get_message(self, message_id):
+    def get_target_chat_id(self, data):
+        """Чат, к которому относится действие клиента"""
+        return self.chat_id
+
+    async def get_message(self, message_id, chat_id):
         """Получение сообщения с проверкой"""
         message = await sync_to_async(Message.objects.select_related('chat', 'sender').get)(
             id=message_id,
-            chat_id=self.chat_id,
+            chat_id=chat_id,
             is_deleted=False
         )
         return message
 
     async def check_edit_permission(self, message):
         """Проверка прав на редактирование"""
-        if message.sender != self.user and not message.chat.admin == self.user:
+        if message.sender_id != self.user.id and message.chat.admin_id != self.user.id:
             raise PermissionDenied("Нет прав на редактирование")
 
     async def check_delete_permission(self, message):
         """Проверка прав на удаление"""
-        if message.sender != self.user and not message.chat.admin == self.user:
+        if message.sender_id != self.user.id and message.chat.admin_id != self.user.id:
             raise PermissionDenied("Нет прав на удаление")
 
-    async def send_chat_history(self):
+    async def send_chat_history(self, chat_id=None):
         """Отправка истории сообщений"""
+        chat_id = chat_id or self.chat_id
         messages = await sync_to_async(list)(
-            Message.objects.filter(chat_id=self.chat_id, is_deleted=False)
+            Message.objects.filter(chat_id=chat_id, is_deleted=False)
                           .order_by('created_at')[:50]
                           .select_related('sender')
         )
@@ -194,6 +212,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
         for message in messages:
             await self.send(text_data=json.dumps({
                 'type': 'chat_message',
+                'chat_id': int(chat_id),
                 'message_id': message.id,
                 'sender': message.sender.username,
                 'text': message.text,
@@ -219,4 +238,123 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
     async def message_deleted(self, event):
         """Обработка удаления для рассылки"""
-        await self.send(text_data=json.dumps(event))
\ No newline at end of file
+        await self.send(text_data=json.dumps(event))
+
+    async def chat_deleted(self, event):
+        """Чат удалён: уведомляем клиента и закрываем соединение"""
+        await self.send(text_data=json.dumps(event))
+        await self.close(code=4010)
+
+
+
+class StreamConsumer(ChatConsumer):
+    """
+    Мультиплексированное соединение (ws/stream/): один сокет на пользователя для многих чатов.
+    Клиент управляет подписками командами subscribe/unsubscribe, все события содержат chat_id.
+    """
+    # Сколько секунд ждать добавления во все группы одной команды subscribe
+    subscribe_timeout = 2.0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.subscriptions = set()
+
+    async def connect(self):
+        self.user = self.scope['user']
+        if not self.user.is_authenticated:
+            await self.close(code=4001)
+            return
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        chat_ids = list(self.subscriptions)
+        self.subscriptions.clear()
+        await asyncio.gather(
+            *(self.channel_layer.group_discard(f'chat_{chat_id}', self.channel_name) for chat_id in chat_ids),
+            return_exceptions=True
+        )
+
+    def get_handlers(self):
+        handlers = super().get_handlers()
+        handlers.update({
+            'subscribe': self.handle_subscribe,
+            'unsubscribe': self.handle_unsubscribe,
+        })
+        return handlers
+
+    def get_target_chat_id(self, data):
+        chat_id = int(data['chat_id'])
+        if chat_id not in self.subscriptions:
+            raise PermissionDenied("Нет подписки на чат")
+        return chat_id
+
+    async def handle_subscribe(self, data):
+        """Подписка на чаты: права проверяются одним запросом на всю пачку"""
+        requested = [int(chat_id) for chat_id in data.get('chat_ids', [])]
+        new_ids = [chat_id for chat_id in dict.fromkeys(requested) if chat_id not in self.subscriptions]
+        limit = getattr(settings, 'CHAT_STREAM_MAX_SUBSCRIPTIONS', 100)
+        if len(self.subscriptions) + len(new_ids) > limit:
+            await self.send_error(f"Превышен лимит подписок на соединение ({limit})")
+            return
+
+        allowed = set(await sync_to_async(list)(
+            Chat.objects.filter(id__in=new_ids, members__id=self.user.id).values_list('id', flat=True)
+        )) if new_ids else set()
+
+        subscribed = set()
+
+        async def subscribe(chat_id):
+            await self.channel_layer.group_add(f'chat_{chat_id}', self.channel_name)
+            # Подписка записывается сразу: таймаут остальных групп не должен её потерять
+            self.subscriptions.add(chat_id)
+            subscribed.add(chat_id)
+
+        try:
+            await asyncio.wait_for(asyncio.gather(*(subscribe(chat_id) for chat_id in allowed)),
+                                   timeout=self.subscribe_timeout)
+        except asyncio.TimeoutError:
+            # Прерванный group_add мог успеть добавить канал в группу
+            await asyncio.gather(
+                *(self.channel_layer.group_discard(f'chat_{chat_id}', self.channel_name)
+                  for chat_id in allowed - subscribed),
+                return_exceptions=True
+            )
+
+        await self.send(text_data=json.dumps({
+            'type': 'subscribed',
+            'chat_ids': sorted(subscribed),
+            'denied': sorted(set(new_ids) - allowed),
+            'failed': sorted(allowed - subscribed),
+        }))
+        if data.get('history'):
+            for chat_id in sorted(subscribed):
+                await self.send_chat_history(chat_id)
+
+    async def handle_unsubscribe(self, data):
+        """Отписка от чатов"""
+        chat_ids = {int(chat_id) for chat_id in data.get('chat_ids', [])} & self.subscriptions
+        self.subscriptions -= chat_ids
+        await asyncio.gather(
+            *(self.channel_layer.group_discard(f'chat_{chat_id}', self.channel_name) for chat_id in chat_ids)
+        )
+        await self.send(text_data=json.dumps({
+            'type': 'unsubscribed',
+            'chat_ids': sorted(chat_ids),
+        }))
+
+    async def chat_deleted(self, event):
+        """Удалённый чат снимается с подписки, соединение остаётся открытым"""
+        chat_id = int(event['chat_id'])
+        if chat_id in self.subscriptions:
+            self.subscriptions.discard(chat_id)
+            await self.channel_layer.group_discard(f'chat_{chat_id}', self.channel_name)
+        await self.send(text_data=json.dumps(event))
+
+
+class ChatPurgeConsumer(SyncConsumer):
+    """
+    Фоновый воркер окончательного удаления чатов.
+    Запуск: python manage.py runworker chat-purge
+    """
+    def purge_chat(self, message):
+        purge_chat(message['chat_id'])
\ No newline at end of file
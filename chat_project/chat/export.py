@@ -0,0 +1,249 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+
+from .bulk import batched, preserve_timestamps
+from .models import Chat, Message, MessageEditHistory, ArchivedMessage
+
+DEFAULT_CHUNK_SIZE = 2000
+# Имена внутри ZIP-архива экспорта
+EXPORT_NAME = 'chat.ndjson'
+MEDIA_PREFIX = 'media/'
+MESSAGE_FIELDS = ('id', 'sender__username', 'text', 'media', 'created_at', 'updated_at', 'is_deleted')
+
+
+def _line(record):
+    return json.dumps(record, ensure_ascii=False) + '\n'
+
+
+def _message_record(row, edit_history, archived=False):
+    return {
+        'type': 'message',
+        'id': row['id'],
+        'sender': row['sender__username'],
+        'text': row['text'],
+        'media': row['media'] or '',
+        'created_at': row['created_at'].isoformat(),
+        'updated_at': row['updated_at'].isoformat(),
+        'is_deleted': row.get('is_deleted', False),
+        'archived': archived,
+        'edit_history': edit_history,
+    }
+
+
+def iter_chat_export(chat, chunk_size=DEFAULT_CHUNK_SIZE, include_deleted=False):
+    """
+    Построчный экспорт чата в NDJSON: заголовок чата, участники, затем сообщения
+    (сначала архивные, потом горячие) вместе с историей изменений.
+    Данные читаются через iterator(), поэтому память не зависит от размера чата.
+    Удалённые сообщения попадают в выгрузку только с include_deleted (полный дамп
+    командой export_chat): участникам чата их текст не показывается.
+    """
+    yield _line({
+        'type': 'chat',
+        'id': chat.id,
+        'name': chat.name,
+        'is_group': chat.is_group,
+        'admin': chat.admin.username if chat.admin_id else None,
+        'created_at': chat.created_at.isoformat(),
+    })
+
+    for username in chat.members.order_by('id').values_list('username', flat=True).iterator(chunk_size=chunk_size):
+        yield _line({'type': 'member', 'username': username})
+
+    # Архив: история хранится внутри строки, нужно только перевести id авторов правок в имена
+    archived = (ArchivedMessage.objects.filter(chat=chat)
+                                       .order_by('id')
+                                       .values('id', 'sender__username', 'text', 'media',
+                                               'created_at', 'updated_at', 'edit_history')
+                                       .iterator(chunk_size=chunk_size))
+    for rows in batched(archived, chunk_size):
+        editor_ids = {edit['edited_by'] for row in rows for edit in row['edit_history']}
+        editors = dict(User.objects.filter(id__in=editor_ids).values_list('id', 'username'))
+        for row in rows:
+            history = [
+                {'old_text': edit['old_text'], 'edited_by': editors.get(edit['edited_by']), 'edited_at': edit['edited_at']}
+                for edit in row['edit_history']
+            ]
+            yield _line(_message_record(row, history, archived=True))
+
+    messages = Message.objects.filter(chat=chat)
+    if not include_deleted:
+        messages = messages.filter(is_deleted=False)
+    messages = (messages.order_by('id')
+                        .values(*MESSAGE_FIELDS)
+                        .iterator(chunk_size=chunk_size))
+    for rows in batched(messages, chunk_size):
+        history = {}
+        for edit in (MessageEditHistory.objects.filter(message_id__in=[row['id'] for row in rows])
+                                               .order_by('-edited_at')
+                                               .values('message_id', 'old_text', 'edited_by__username', 'edited_at')):
+            history.setdefault(edit['message_id'], []).append({
+                'old_text': edit['old_text'],
+                'edited_by': edit['edited_by__username'],
+                'edited_at': edit['edited_at'].isoformat(),
+            })
+        for row in rows:
+            yield _line(_message_record(row, history.get(row['id'], [])))
+
+
+async def aiter_chat_export(chat, chunk_size=DEFAULT_CHUNK_SIZE, include_deleted=False):
+    """
+    Асинхронная обёртка над iter_chat_export для ASGI.
+    StreamingHttpResponse под ASGI собирает синхронный итератор в список целиком,
+    поэтому строки забираются из генератора пачками через sync_to_async.
+    """
+    batches = batched(iter_chat_export(chat, chunk_size=chunk_size, include_deleted=include_deleted), chunk_size)
+    try:
+        while True:
+            lines = await sync_to_async(next)(batches, None)
+            if lines is None:
+                return
+            for line in lines:
+                yield line
+    finally:
+        # Генератор держит курсор БД, закрываем его в том же потоке, где он работал
+        await sync_to_async(batches.close)()
+
+
+def iter_media_names(chat, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Имена медиафайлов чата (горячих и архивных сообщений).
+    """
+    for model in (ArchivedMessage, Message):
+        names = (model.objects.filter(chat=chat)
+                              .exclude(media='')
+                              .exclude(media__isnull=True)
+                              .order_by('id')
+                              .values_list('media', flat=True)
+                              .iterator(chunk_size=chunk_size))
+        yield from names
+
+
+class ChatImportError(Exception):
+    """
+    Ошибка в данных импорта.
+    """
+
+
+class ChatImporter:
+    """
+    Загрузка чата из NDJSON-экспорта пачками через bulk_create.
+    Чат всегда создаётся заново, id сообщений не сохраняются.
+    """
+    def __init__(self, batch_size=DEFAULT_CHUNK_SIZE, create_users=False, media_loader=None):
+        self.batch_size = batch_size
+        self.create_users = create_users
+        self.media_loader = media_loader
+        self.users = {}
+        self.chat = None
+        self.messages = 0
+
+    def resolve_users(self, usernames):
+        """
+        Сопоставление имён пользователей с id; недостающие создаются с неиспользуемым паролем.
+        """
+        missing = {name for name in usernames if name and name not in self.users}
+        if not missing:
+            return
+        self.users.update(User.objects.filter(username__in=missing).values_list('username', 'id'))
+        missing -= self.users.keys()
+        if not missing:
+            return
+        if not self.create_users:
+            raise ChatImportError(f"Пользователи не найдены: {', '.join(sorted(missing)[:10])}")
+        password = make_password(None)
+        User.objects.bulk_create([User(username=name, password=password) for name in missing])
+        self.users.update(User.objects.filter(username__in=missing).values_list('username', 'id'))
+
+    def load(self, lines):
+        """
+        Загрузка всего экспорта в одной транзакции: при ошибке в середине файла
+        в базе не остаётся частично загруженного чата.
+        """
+        with transaction.atomic(), preserve_timestamps():
+            records = (json.loads(line) for line in lines if line.strip())
+            members = []
+            messages = []
+            for record in records:
+                kind = record.get('type')
+                if kind == 'chat':
+                    self.create_chat(record)
+                elif self.chat is None:
+                    raise ChatImportError("Первая запись экспорта должна описывать чат")
+                elif kind == 'member':
+                    members.append(record['username'])
+                    if len(members) >= self.batch_size:
+                        self.add_members(members)
+                        members = []
+                elif kind == 'message':
+                    messages.append(record)
+                    if len(messages) >= self.batch_size:
+                        self.add_messages(messages)
+                        messages = []
+            if self.chat is None:
+                raise ChatImportError("Экспорт не содержит чата")
+            if members:
+                self.add_members(members)
+            if messages:
+                self.add_messages(messages)
+        return self.chat
+
+    def create_chat(self, record):
+        if self.chat is not None:
+            raise ChatImportError("Экспорт содержит больше одного чата")
+        admin = record.get('admin')
+        self.resolve_users([admin])
+        self.chat = Chat.objects.create(
+            name=record['name'],
+            is_group=record.get('is_group', False),
+            admin_id=self.users.get(admin),
+            created_at=parse_datetime(record['created_at']),
+        )
+
+    def add_members(self, usernames):
+        self.resolve_users(usernames)
+        through = Chat.members.through
+        through.objects.bulk_create(
+            [through(chat_id=self.chat.id, user_id=self.users[name]) for name in usernames],
+            ignore_conflicts=True,
+        )
+
+    def add_messages(self, records):
+        self.resolve_users(
+            [record['sender'] for record in records]
+            + [edit['edited_by'] for record in records for edit in record.get('edit_history', [])]
+        )
+        created = Message.objects.bulk_create([
+            Message(
+                chat_id=self.chat.id,
+                sender_id=self.users[record['sender']],
+                text=record.get('text'),
+                media=self.load_media(record.get('media')),
+                created_at=parse_datetime(record['created_at']),
+                updated_at=parse_datetime(record['updated_at']),
+                is_deleted=record.get('is_deleted', False),
+            )
+            for record in records
+        ], batch_size=self.batch_size)
+        MessageEditHistory.objects.bulk_create([
+            MessageEditHistory(
+                message_id=message.id,
+                old_text=edit['old_text'] or '',
+                edited_by_id=self.users[edit['edited_by']],
+                edited_at=parse_datetime(edit['edited_at']),
+            )
+            for message, record in zip(created, records)
+            for edit in record.get('edit_history', [])
+            if edit.get('edited_by') in self.users
+        ], batch_size=self.batch_size)
+        self.messages += len(records)
+
+    def load_media(self, name):
+        if not name or self.media_loader is None:
+            return name or None
+        return self.media_loader(name)
@@ -0,0 +1,21 @@
+from django.conf import settings
+
+DEFAULT_FRAGMENT_CACHE_TIMEOUT = 3600
+
+
+def get_fragment_cache_timeout():
+    """
+    Время жизни кэшированных фрагментов шаблонов (в секундах).
+    """
+    return getattr(settings, 'CHAT_FRAGMENT_CACHE_TIMEOUT', DEFAULT_FRAGMENT_CACHE_TIMEOUT)
+
+
+def get_viewer_role(message, user, chat):
+    """
+    Роль зрителя относительно сообщения: от неё зависят класс блока и кнопки управления.
+    """
+    if message.sender_id == user.id:
+        return 'owner'
+    if chat.admin_id == user.id:
+        return 'admin'
+    return 'viewer'
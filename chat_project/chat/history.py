@@ -0,0 +1,94 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Window
+from django.db.models.functions import RowNumber
+
+from .bulk import batched
+from .models import MessageEditHistory
+
+# Значения по умолчанию, если в settings ничего не задано
+DEFAULT_MAX_VERSIONS = 50
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_BULK_VERSIONS = 3
+MAX_BULK_IDS = 200
+MAX_BULK_VERSIONS = 20
+
+
+def get_max_versions():
+    """
+    Сколько последних версий истории хранить для одного сообщения (0 — без ограничения).
+    """
+    return getattr(settings, 'CHAT_EDIT_HISTORY_MAX_VERSIONS', DEFAULT_MAX_VERSIONS)
+
+
+def _ranked_history():
+    """
+    История с номером версии (1 — последняя) и числом правок внутри каждого сообщения.
+    Окно по (message, -edited_at) читается из составного индекса без сортировки.
+    """
+    return MessageEditHistory.objects.annotate(
+        rank=Window(RowNumber(), partition_by=[F('message_id')], order_by=F('edited_at').desc()),
+        edit_count=Window(Count('id'), partition_by=[F('message_id')]),
+    )
+
+
+def get_history_summary(user, message_ids, versions=DEFAULT_BULK_VERSIONS):
+    """
+    Число правок и последние версии для набора сообщений одним запросом.
+    Учитываются только сообщения из неудалённых чатов, где пользователь — участник.
+    Сообщения без правок в результат не попадают.
+    """
+    rows = (_ranked_history()
+            .filter(message_id__in=message_ids,
+                    message__chat__is_deleted=False,
+                    message__chat__members=user,
+                    rank__lte=versions)
+            .order_by('message_id', 'rank')
+            .values('message_id', 'edit_count', 'old_text', 'edited_by__username', 'edited_at'))
+
+    summary = {}
+    for row in rows:
+        entry = summary.setdefault(row['message_id'], {'edit_count': row['edit_count'], 'versions': []})
+        entry['versions'].append({
+            'old_text': row['old_text'],
+            'edited_by': row['edited_by__username'],
+            'edited_at': row['edited_at'].strftime('%Y-%m-%d %H:%M:%S'),
+        })
+    return summary
+
+
+def compact_edit_history(max_versions=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Удаление версий истории сверх лимита на сообщение.
+    Сообщения обрабатываются пачками, каждая пачка чистится в отдельной транзакции.
+    Возвращает количество удалённых записей истории.
+    """
+    if max_versions is None:
+        max_versions = get_max_versions()
+    if max_versions <= 0:
+        return 0
+
+    candidates = (MessageEditHistory.objects.values('message_id')
+                                            .annotate(total=Count('id'))
+                                            .filter(total__gt=max_versions)
+                                            .order_by('message_id')
+                                            .values_list('message_id', flat=True))
+    removed = 0
+    last_id = 0
+
+    while True:
+        message_ids = list(candidates.filter(message_id__gt=last_id)[:batch_size])
+        if not message_ids:
+            break
+        last_id = message_ids[-1]
+
+        with transaction.atomic():
+            stale_ids = list(
+                _ranked_history().filter(message_id__in=message_ids, rank__gt=max_versions)
+                                 .values_list('id', flat=True)
+            )
+            for chunk in batched(stale_ids, batch_size):
+                deleted, _ = MessageEditHistory.objects.filter(id__in=chunk).delete()
+                removed += deleted
+
+    return removed
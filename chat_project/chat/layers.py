@@ -0,0 +1,607 @@
+import asyncio
+import json
+import logging
+import random
+import string
+import struct
+import time
+import uuid
+from copy import deepcopy
+
+from channels.exceptions import ChannelFull
+from channels.layers import InMemoryChannelLayer
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+def _random_string(length=12):
+    return ''.join(random.choice(string.ascii_letters) for _ in range(length))
+
+
+class LocalChannelLayer(InMemoryChannelLayer):
+    """
+    Слой каналов для одного процесса: доставка через asyncio-очереди с ограниченной
+    ёмкостью и временем жизни сообщений, без обращений к Redis.
+
+    Если задан bridge, групповые сообщения и сообщения в каналы других процессов
+    пересылаются через транспорт (см. UnixSocketTransport, RedisPubSubTransport).
+    Внутрипроцессная доставка при этом остаётся локальной. Без моста сообщения
+    в именованные каналы, которые в этом процессе никто не слушает (например,
+    chat-purge), отбрасываются с предупреждением в лог.
+
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'chat.layers.LocalChannelLayer',
+            'CONFIG': {
+                'capacity': 100,
+                'expiry': 60,
+                'bridge': {'transport': 'chat.layers.UnixSocketTransport', 'path': '/tmp/chat-broker.sock'},
+            },
+        },
+    }
+    """
+    # Как часто (в секундах) чистить просроченные сообщения и участников групп
+    clean_interval = 1.0
+
+    def __init__(self, bridge=None, **kwargs):
+        super().__init__(**kwargs)
+        self.process_id = uuid.uuid4().hex[:12]
+        self.listening = set()
+        self._last_clean = 0.0
+        self.bridge = None
+        if bridge:
+            options = dict(bridge)
+            transport_class = import_string(options.pop('transport'))
+            self.bridge = transport_class(self.process_id, self._receive_from_bridge, **options)
+
+    # Channel layer API
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "message is not a dict"
+        self.require_valid_channel_name(channel)
+        assert "__asgi_channel__" not in message
+
+        if self.bridge is not None and not self.is_local_channel(channel):
+            await self._call_bridge('send', channel, message)
+            return
+        if self.bridge is None and '!' not in channel and channel not in self.listening:
+            # Читателя нет: очередь копилась бы до ChannelFull у отправителя
+            logger.warning("Сообщение в канал %s отброшено: канал никто не слушает, мост не настроен", channel)
+            return
+        self._put(channel, deepcopy(message))
+
+    async def receive(self, channel):
+        self.require_valid_channel_name(channel)
+        self._maybe_clean_expired()
+
+        # Именованный канал (например, канал воркера) слушается локально и через мост
+        if '!' not in channel and channel not in self.listening:
+            self.listening.add(channel)
+            if self.bridge is not None:
+                await self._call_bridge('listen', channel)
+        elif self.bridge is not None:
+            # Брокер должен знать процесс, чтобы доставлять в его каналы
+            await self._call_bridge('connect')
+
+        queue = self.channels.setdefault(channel, asyncio.Queue(maxsize=self.get_capacity(channel)))
+        try:
+            _, message = await queue.get()
+        finally:
+            if queue.empty():
+                self.channels.pop(channel, None)
+        return message
+
+    async def new_channel(self, prefix="specific."):
+        return f"{prefix}.local-{self.process_id}!{_random_string()}"
+
+    def is_local_channel(self, channel):
+        """
+        Канал обслуживается этим процессом: специфичный канал с нашим id
+        или именованный канал, который здесь слушают.
+        """
+        if '!' in channel:
+            return self._channel_owner(channel) == self.process_id
+        return channel in self.listening
+
+    @staticmethod
+    def _channel_owner(channel):
+        return channel.split('!', 1)[0].rsplit('.local-', 1)[-1]
+
+    # Groups extension
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        first = group not in self.groups
+        self.groups.setdefault(group, {})[channel] = time.time()
+        if first and self.bridge is not None:
+            await self._call_bridge('subscribe', group)
+
+    async def group_discard(self, group, channel):
+        self.require_valid_channel_name(channel)
+        self.require_valid_group_name(group)
+        group_channels = self.groups.get(group)
+        if not group_channels:
+            return
+        group_channels.pop(channel, None)
+        if not group_channels:
+            self.groups.pop(group, None)
+            if self.bridge is not None:
+                await self._call_bridge('unsubscribe', group)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "Message is not a dict"
+        self.require_valid_group_name(group)
+        self._maybe_clean_expired()
+        self._deliver_to_group(group, message)
+        if self.bridge is not None:
+            await self._call_bridge('publish', group, message)
+
+    # Flush extension
+
+    async def flush(self):
+        await super().flush()
+        self.listening = set()
+
+    async def close(self):
+        if self.bridge is not None:
+            await self.bridge.close()
+
+    # Internals
+
+    async def _call_bridge(self, method, *args):
+        """
+        Сбой моста не должен ломать локальную доставку: ошибка пишется в лог,
+        а подписки транспорт восстановит при следующем подключении.
+        """
+        try:
+            await getattr(self.bridge, method)(*args)
+        except self.bridge.errors as e:
+            logger.warning("Мост слоя каналов недоступен (%s): %s", method, e)
+
+    def _put(self, channel, message):
+        queue = self.channels.setdefault(channel, asyncio.Queue(maxsize=self.get_capacity(channel)))
+        try:
+            queue.put_nowait((time.time() + self.expiry, message))
+        except asyncio.QueueFull:
+            raise ChannelFull(channel)
+
+    def _deliver_to_group(self, group, message):
+        """
+        Сообщение копируется один раз на всю группу; участники получают поверхностные копии.
+        """
+        channels = self.groups.get(group)
+        if not channels:
+            return
+        message = deepcopy(message)
+        for channel in list(channels):
+            try:
+                self._put(channel, dict(message))
+            except ChannelFull:
+                pass
+
+    def _maybe_clean_expired(self):
+        # Полный обход очередей на каждое сообщение дорог при тысячах соединений
+        now = time.monotonic()
+        if now - self._last_clean >= self.clean_interval:
+            self._last_clean = now
+            self._clean_expired()
+
+    def _receive_from_bridge(self, kind, name, message):
+        if kind == 'group':
+            self._deliver_to_group(name, message)
+        elif kind == 'channel':
+            try:
+                self._put(name, message)
+            except ChannelFull:
+                pass
+
+
+class BridgeTransport:
+    """
+    Базовый транспорт моста между процессами. on_message(kind, name, message)
+    вызывается для входящих сообщений: kind — 'group' или 'channel'.
+    В errors перечислены исключения недоступного брокера, которые слой перехватывает.
+    """
+    errors = (OSError,)
+
+    def __init__(self, process_id, on_message):
+        self.process_id = process_id
+        self.on_message = on_message
+
+    async def connect(self):
+        """
+        Подключение к брокеру, если его ещё нет.
+        """
+        raise NotImplementedError
+
+    async def subscribe(self, group):
+        raise NotImplementedError
+
+    async def unsubscribe(self, group):
+        raise NotImplementedError
+
+    async def listen(self, channel):
+        raise NotImplementedError
+
+    async def publish(self, group, message):
+        raise NotImplementedError
+
+    async def send(self, channel, message):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+def encode_frame(payload):
+    data = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return struct.pack('>I', len(data)) + data
+
+
+async def read_frame(reader):
+    header = await reader.readexactly(4)
+    (length,) = struct.unpack('>I', header)
+    return json.loads(await reader.readexactly(length))
+
+
+class UnixSocketTransport(BridgeTransport):
+    """
+    Мост через локальный брокер на Unix-сокете (python manage.py run_channel_broker).
+    Подходит для нескольких процессов на одной машине и для тестов.
+
+    Брокер сообщает, какие процессы подписаны на группы, поэтому group_send уходит
+    в сокет, только если у группы есть участники в других процессах.
+    """
+    def __init__(self, process_id, on_message, path):
+        super().__init__(process_id, on_message)
+        self.path = path
+        self.groups = set()
+        self.listening = set()
+        self.remote_groups = {}
+        self._reader = None
+        self._writer = None
+        self._reader_task = None
+        self._loop = None
+        self._lock = None
+
+    async def _ensure_connected(self):
+        loop = asyncio.get_running_loop()
+        if self._writer is not None and self._loop is loop and not self._writer.is_closing():
+            return
+        if self._lock is None or self._loop is not loop:
+            self._lock = asyncio.Lock()
+            self._loop = loop
+            self._writer = None
+        async with self._lock:
+            if self._writer is not None and not self._writer.is_closing():
+                return
+            self._reader, self._writer = await asyncio.open_unix_connection(self.path)
+            self._writer.write(encode_frame({'op': 'hello', 'process': self.process_id}))
+            # После переподключения брокер должен заново узнать о подписках
+            for group in self.groups:
+                self._writer.write(encode_frame({'op': 'sub', 'group': group}))
+            for channel in self.listening:
+                self._writer.write(encode_frame({'op': 'listen', 'channel': channel}))
+            await self._writer.drain()
+            # Ждём от брокера карту подписок, иначе первые group_send потерялись бы
+            ready = loop.create_future()
+            self._reader_task = loop.create_task(self._read_loop(self._reader, ready))
+            await ready
+
+    async def _read_loop(self, reader, ready):
+        try:
+            while True:
+                frame = await read_frame(reader)
+                if frame['kind'] == 'ready':
+                    ready.set_result(True)
+                    continue
+                if frame['kind'] == 'interest':
+                    processes = set(frame['message']) - {self.process_id}
+                    if processes:
+                        self.remote_groups[frame['name']] = processes
+                    else:
+                        self.remote_groups.pop(frame['name'], None)
+                    continue
+                self.on_message(frame['kind'], frame['name'], frame['message'])
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            self._writer = None
+            if not ready.done():
+                ready.set_exception(ConnectionError(f"Брокер {self.path} закрыл соединение: {e}"))
+
+    async def _write(self, payload):
+        await self._ensure_connected()
+        self._writer.write(encode_frame(payload))
+        await self._writer.drain()
+
+    async def connect(self):
+        await self._ensure_connected()
+
+    async def subscribe(self, group):
+        self.groups.add(group)
+        await self._write({'op': 'sub', 'group': group})
+
+    async def unsubscribe(self, group):
+        self.groups.discard(group)
+        await self._write({'op': 'unsub', 'group': group})
+
+    async def listen(self, channel):
+        self.listening.add(channel)
+        await self._write({'op': 'listen', 'channel': channel})
+
+    async def publish(self, group, message):
+        await self._ensure_connected()
+        if group not in self.remote_groups:
+            return
+        await self._write({'op': 'pub', 'group': group, 'message': message})
+
+    async def send(self, channel, message):
+        await self._write({'op': 'send', 'channel': channel, 'message': message})
+
+    async def close(self):
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+        self._writer = None
+
+
+class UnixSocketBroker:
+    """
+    Брокер для UnixSocketTransport. Пересылает групповые сообщения только процессам,
+    подписанным на группу (кроме отправителя), а сообщения в каналы — их владельцу.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.server = None
+        self.processes = {}
+        self.process_ids = {}
+        self.groups = {}
+        self.listeners = {}
+        self.clients = {}
+
+    async def start(self):
+        self.server = await asyncio.start_unix_server(self._handle_client, path=self.path)
+        return self
+
+    async def serve_forever(self):
+        if self.server is None:
+            await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def close(self):
+        if self.server is None:
+            return
+        self.server.close()
+        # Закрываем клиентов и дожидаемся завершения их обработчиков
+        for writer in list(self.clients):
+            writer.close()
+        await asyncio.gather(*self.clients.values(), return_exceptions=True)
+        await self.server.wait_closed()
+
+    async def _handle_client(self, reader, writer):
+        process_id = None
+        subscriptions = set()
+        listening = set()
+        self.clients[writer] = asyncio.current_task()
+        try:
+            while True:
+                frame = await read_frame(reader)
+                op = frame['op']
+                if op == 'hello':
+                    process_id = frame['process']
+                    self.processes[process_id] = writer
+                    self.process_ids[writer] = process_id
+                    # Новый процесс получает текущую карту подписок
+                    for group in self.groups:
+                        writer.write(self._interest_frame(group))
+                    writer.write(encode_frame({'kind': 'ready', 'name': '', 'message': None}))
+                elif op == 'sub':
+                    subscriptions.add(frame['group'])
+                    writers = self.groups.setdefault(frame['group'], set())
+                    if writer not in writers:
+                        writers.add(writer)
+                        self._broadcast(self._interest_frame(frame['group']))
+                elif op == 'unsub':
+                    subscriptions.discard(frame['group'])
+                    if writer in self.groups.get(frame['group'], ()):
+                        self._discard(self.groups, frame['group'], writer)
+                        self._broadcast(self._interest_frame(frame['group']))
+                elif op == 'listen':
+                    listening.add(frame['channel'])
+                    self.listeners.setdefault(frame['channel'], set()).add(writer)
+                elif op == 'pub':
+                    payload = encode_frame({'kind': 'group', 'name': frame['group'], 'message': frame['message']})
+                    for target in self.groups.get(frame['group'], ()):
+                        if target is not writer:
+                            target.write(payload)
+                elif op == 'send':
+                    target = self._channel_target(frame['channel'])
+                    if target is not None:
+                        target.write(encode_frame({'kind': 'channel', 'name': frame['channel'], 'message': frame['message']}))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if process_id is not None and self.processes.get(process_id) is writer:
+                del self.processes[process_id]
+            self.process_ids.pop(writer, None)
+            self.clients.pop(writer, None)
+            for group in subscriptions:
+                self._discard(self.groups, group, writer)
+                self._broadcast(self._interest_frame(group))
+            for channel in listening:
+                self._discard(self.listeners, channel, writer)
+            writer.close()
+
+    def _interest_frame(self, group):
+        processes = [self.process_ids.get(writer) for writer in self.groups.get(group, ())]
+        return encode_frame({'kind': 'interest', 'name': group, 'message': processes})
+
+    def _broadcast(self, payload):
+        for writer in self.processes.values():
+            writer.write(payload)
+
+    def _channel_target(self, channel):
+        if '!' in channel:
+            return self.processes.get(LocalChannelLayer._channel_owner(channel))
+        listeners = self.listeners.get(channel)
+        if not listeners:
+            return None
+        return random.choice(tuple(listeners))
+
+    @staticmethod
+    def _discard(mapping, key, writer):
+        writers = mapping.get(key)
+        if writers is not None:
+            writers.discard(writer)
+            if not writers:
+                del mapping[key]
+
+
+class RedisPubSubTransport(BridgeTransport):
+    """
+    Мост через Redis pub/sub для нескольких машин. В Redis попадают только
+    групповые сообщения и сообщения в каналы других процессов.
+
+    Как и у UnixSocketTransport, group_send публикуется, только если на группу
+    подписаны другие процессы. Подписчики группы хранятся в множестве Redis
+    (prefix + 'members:<группа>'), изменения рассылаются по теме prefix + 'interest'.
+    Множество читается при первой публикации в группу, дальше поддерживается
+    по рассылке. Процесс, завершившийся без close(), остаётся в множестве:
+    публикации для него лишние, но безвредные.
+    """
+    def __init__(self, process_id, on_message, url='redis://127.0.0.1:6379/0', prefix='chat-layer:'):
+        super().__init__(process_id, on_message)
+        import redis.asyncio as redis
+        from redis.exceptions import RedisError
+
+        self.redis_module = redis
+        self.errors = (OSError, RedisError)
+        self.url = url
+        self.prefix = prefix
+        self.topics = set()
+        self.groups = set()
+        self.remote_groups = {}
+        self._client = None
+        self._pubsub = None
+        self._reader_task = None
+        self._loop = None
+
+    async def _ensure_connected(self):
+        loop = asyncio.get_running_loop()
+        if self._client is not None and self._loop is loop:
+            return
+        client = self.redis_module.from_url(self.url)
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(self._topic('process', self.process_id), self.prefix + 'interest', *self.topics)
+            # После переподключения другие процессы должны заново узнать о подписках
+            for group in self.groups:
+                await client.sadd(self._members_key(group), self.process_id)
+        except self.errors:
+            # Без брокера следующая операция попробует подключиться заново
+            await pubsub.aclose()
+            await client.aclose()
+            raise
+        self._loop = loop
+        self._client = client
+        self._pubsub = pubsub
+        # Пока соединения не было, рассылки об интересе могли потеряться
+        self.remote_groups = {}
+        self._reader_task = loop.create_task(self._read_loop(self._pubsub))
+
+    def _topic(self, kind, name):
+        return f'{self.prefix}{kind}:{name}'
+
+    def _members_key(self, group):
+        return f'{self.prefix}members:{group}'
+
+    async def _read_loop(self, pubsub):
+        async for item in pubsub.listen():
+            payload = json.loads(item['data'])
+            if payload.get('origin') == self.process_id:
+                continue
+            if payload['kind'] == 'interest':
+                processes = self.remote_groups.get(payload['name'])
+                if processes is not None:
+                    if payload['message']:
+                        processes.add(payload['origin'])
+                    else:
+                        processes.discard(payload['origin'])
+                continue
+            self.on_message(payload['kind'], payload['name'], payload['message'])
+
+    async def _subscribe(self, topic):
+        if topic not in self.topics:
+            # Тема запоминается до подключения, чтобы подписка восстановилась при переподключении
+            self.topics.add(topic)
+            await self._ensure_connected()
+            await self._pubsub.subscribe(topic)
+
+    async def _publish(self, topic, kind, name, message):
+        await self._ensure_connected()
+        payload = {'origin': self.process_id, 'kind': kind, 'name': name, 'message': message}
+        await self._client.publish(topic, json.dumps(payload, separators=(',', ':')))
+
+    async def _remote_processes(self, group):
+        processes = self.remote_groups.get(group)
+        if processes is None:
+            members = await self._client.smembers(self._members_key(group))
+            processes = {member.decode() for member in members} - {self.process_id}
+            self.remote_groups[group] = processes
+        return processes
+
+    async def connect(self):
+        await self._ensure_connected()
+
+    async def subscribe(self, group):
+        if group in self.groups:
+            return
+        self.groups.add(group)
+        await self._subscribe(self._topic('group', group))
+        await self._client.sadd(self._members_key(group), self.process_id)
+        await self._publish(self.prefix + 'interest', 'interest', group, True)
+
+    async def unsubscribe(self, group):
+        if group not in self.groups:
+            return
+        self.groups.discard(group)
+        topic = self._topic('group', group)
+        self.topics.discard(topic)
+        await self._ensure_connected()
+        await self._pubsub.unsubscribe(topic)
+        await self._client.srem(self._members_key(group), self.process_id)
+        await self._publish(self.prefix + 'interest', 'interest', group, False)
+
+    async def listen(self, channel):
+        await self._subscribe(self._topic('channel', channel))
+
+    async def publish(self, group, message):
+        await self._ensure_connected()
+        if not await self._remote_processes(group):
+            return
+        await self._publish(self._topic('group', group), 'group', group, message)
+
+    async def send(self, channel, message):
+        if '!' in channel:
+            topic = self._topic('process', LocalChannelLayer._channel_owner(channel))
+        else:
+            topic = self._topic('channel', channel)
+        await self._publish(topic, 'channel', channel, message)
+
+    async def close(self):
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+        if self._client is not None and self.groups:
+            try:
+                for group in self.groups:
+                    await self._client.srem(self._members_key(group), self.process_id)
+                    await self._publish(self.prefix + 'interest', 'interest', group, False)
+            except self.errors:
+                pass
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+        if self._client is not None:
+            await self._client.aclose()
+        self._client = None
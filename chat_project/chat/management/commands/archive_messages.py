@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from chat.archive import DEFAULT_BATCH_SIZE, archive_chat_messages, purge_deleted_messages
+from chat.models import Chat
+
+
+class Command(BaseCommand):
+    help = "Переносит старые сообщения в архив и удаляет мягко удалённые сообщения после льготного периода"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help="Количество сообщений в одной транзакции")
+        parser.add_argument('--chat', type=int, action='append', dest='chat_ids',
+                            help="Обработать только указанные чаты (можно повторять)")
+        parser.add_argument('--skip-purge', action='store_true',
+                            help="Не удалять мягко удалённые сообщения")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        chats = Chat.objects.order_by('id')
+        if options['chat_ids']:
+            chats = chats.filter(id__in=options['chat_ids'])
+
+        total = 0
+        for chat in chats.iterator():
+            archived = archive_chat_messages(chat, batch_size=batch_size)
+            if archived:
+                self.stdout.write(f"Чат {chat.id}: в архив перенесено {archived} сообщений")
+            total += archived
+        self.stdout.write(self.style.SUCCESS(f"Всего перенесено в архив: {total}"))
+
+        if not options['skip_purge']:
+            purged = purge_deleted_messages(batch_size=batch_size)
+            self.stdout.write(self.style.SUCCESS(f"Окончательно удалено сообщений: {purged}"))
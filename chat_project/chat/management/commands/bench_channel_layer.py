@@ -0,0 +1,80 @@
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from chat.layers import LocalChannelLayer, UnixSocketBroker
+
+
+class Command(BaseCommand):
+    help = "Сравнивает задержку group_send → receive для LocalChannelLayer, моста через Unix-сокет и RedisChannelLayer"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=2000)
+        parser.add_argument('--redis-host', default='127.0.0.1')
+        parser.add_argument('--redis-port', type=int, default=6379)
+
+    def handle(self, *args, **options):
+        asyncio.run(self.run(options))
+
+    async def run(self, options):
+        count = options['messages']
+
+        layer = LocalChannelLayer()
+        self.report("LocalChannelLayer", await self.measure(layer, layer, count))
+
+        # Два экземпляра слоя с разными id процесса имитируют два процесса
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'broker.sock')
+            broker = await UnixSocketBroker(path).start()
+            bridge = {'transport': 'chat.layers.UnixSocketTransport', 'path': path}
+            sender, receiver = LocalChannelLayer(bridge=bridge), LocalChannelLayer(bridge=bridge)
+            try:
+                self.report("LocalChannelLayer + Unix-сокет (между процессами)",
+                            await self.measure(sender, receiver, count))
+            finally:
+                await sender.close()
+                await receiver.close()
+                await broker.close()
+
+        try:
+            from channels_redis.core import RedisChannelLayer
+            from redis.exceptions import ConnectionError as RedisConnectionError
+        except ImportError:
+            self.stdout.write("RedisChannelLayer: пропущено, channels_redis не установлен")
+            return
+        redis_layer = RedisChannelLayer(hosts=[(options['redis_host'], options['redis_port'])])
+        try:
+            latencies = await self.measure(redis_layer, redis_layer, count)
+        except (OSError, RedisConnectionError) as e:
+            self.stdout.write(f"RedisChannelLayer: пропущено, Redis недоступен ({e})")
+            return
+        self.report("RedisChannelLayer", latencies)
+        await redis_layer.flush()
+
+    async def measure(self, sender, receiver, count):
+        channel = await receiver.new_channel()
+        await receiver.group_add('bench', channel)
+        # Даём мосту разослать информацию о подписке
+        await asyncio.sleep(0.05)
+        latencies = []
+        try:
+            for n in range(count):
+                started = time.perf_counter()
+                await sender.group_send('bench', {'type': 'bench.message', 'n': n})
+                await asyncio.wait_for(receiver.receive(channel), timeout=5)
+                latencies.append(time.perf_counter() - started)
+        finally:
+            await receiver.group_discard('bench', channel)
+        return latencies
+
+    def report(self, label, latencies):
+        latencies = sorted(latencies)
+        p99 = latencies[int(len(latencies) * 0.99) - 1]
+        self.stdout.write(
+            f"{label}: среднее {statistics.mean(latencies) * 1e6:.0f} мкс, "
+            f"медиана {statistics.median(latencies) * 1e6:.0f} мкс, p99 {p99 * 1e6:.0f} мкс"
+        )
@@ -0,0 +1,109 @@
+import time
+import uuid
+from itertools import cycle
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from chat.models import Chat, Message
+
+try:
+    from redis.exceptions import ConnectionError as RedisConnectionError
+except ImportError:
+    RedisConnectionError = OSError
+
+DUMMY_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+# Кэш Django без явных настроек: LocMemCache на 300 записей
+DEFAULT_LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+class Command(BaseCommand):
+    help = "Замеряет время отрисовки страниц чатов без кэша фрагментов и с ним"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=200, help="Сообщений на странице")
+        parser.add_argument('--members', type=int, default=20)
+        parser.add_argument('--chats', type=int, default=5,
+                            help="Сколько чатов открывается вперемешку")
+        parser.add_argument('--viewers', type=int, default=3,
+                            help="Сколько участников с разными ролями открывают каждый чат")
+        parser.add_argument('--requests', type=int, default=50)
+
+    def handle(self, *args, **options):
+        # Замер выполняется на временной тестовой базе, рабочие данные не затрагиваются
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            # Подготовка данных не должна зависеть от доступности настроенного кэша
+            with override_settings(CACHES=DUMMY_CACHES):
+                pages = self.prepare(options)
+            # Третий элемент — можно ли очищать кэш перед замером (только кэши в памяти процесса)
+            variants = (
+                ('Без кэша фрагментов', DUMMY_CACHES, True),
+                ('LocMemCache по умолчанию (300 записей)', DEFAULT_LOCMEM_CACHES, True),
+                ('Кэш из settings.CACHES', self.isolated(settings.CACHES), False),
+            )
+            with override_settings(CHAT_PAGE_SIZE=options['messages'], ALLOWED_HOSTS=['testserver']):
+                for label, caches, clear in variants:
+                    with override_settings(CACHES=caches):
+                        try:
+                            if clear:
+                                cache.clear()
+                            elapsed = self.measure(pages, options['requests'])
+                        except (OSError, RedisConnectionError) as e:
+                            self.stdout.write(f"{label}: недоступен ({e})")
+                            continue
+                    self.stdout.write(f"{label}: {elapsed * 1000:.1f} мс на страницу")
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def isolated(self, caches):
+        """
+        Настроенный кэш с уникальным префиксом: замер начинается с пустого кэша
+        и не трогает рабочие записи (clear() у Redis очистил бы всю базу).
+        """
+        default = dict(caches['default'])
+        default['KEY_PREFIX'] = f'bench_chat_render_{uuid.uuid4().hex}'
+        return {'default': default}
+
+    def prepare(self, options):
+        users = [User.objects.create_user(username=f'bench_render_{n}') for n in range(options['members'])]
+        extensions = ['.jpg', '.png', '.mp4', '.pdf', '']
+        pages = []
+        for chat_number in range(options['chats']):
+            chat = Chat.objects.create(name=f'bench_{chat_number}', is_group=True, admin=users[0])
+            chat.members.add(*users)
+            Message.objects.bulk_create([
+                Message(
+                    chat=chat,
+                    sender=users[n % len(users)],
+                    text=f"Сообщение {n}",
+                    media=f"chat_media/bench_{n}{extensions[n % len(extensions)]}" if n % 3 == 0 else None,
+                )
+                for n in range(options['messages'])
+            ])
+            url = reverse('chat_detail', args=[chat.id])
+            # Администратор, автор части сообщений и обычные участники видят разные кнопки
+            pages.extend((url, user) for user in users[:options['viewers']])
+
+        clients = {}
+        for _, user in pages:
+            if user.pk not in clients:
+                clients[user.pk] = Client()
+                clients[user.pk].force_login(user)
+        return [(url, clients[user.pk]) for url, user in pages]
+
+    def measure(self, pages, requests):
+        # Первый проход заполняет кэш и не учитывается
+        for url, client in pages:
+            client.get(url)
+        started = time.perf_counter()
+        for _, (url, client) in zip(range(requests), cycle(pages)):
+            response = client.get(url)
+            assert response.status_code == 200, response.status_code
+        return (time.perf_counter() - started) / requests
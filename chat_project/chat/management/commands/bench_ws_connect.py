@@ -0,0 +1,76 @@
+import asyncio
+import time
+
+from channels.auth import AuthMiddlewareStack
+from channels.consumer import AsyncConsumer
+from channels.exceptions import StopConsumer
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+
+from chat.middleware import CachedAuthMiddlewareStack, user_cache
+
+
+class ProbeConsumer(AsyncConsumer):
+    """
+    Минимальный consumer: принимает соединение только аутентифицированного пользователя.
+    Слой каналов не используется, чтобы в замер попадала только аутентификация.
+    """
+    channel_layer_alias = None
+
+    async def websocket_connect(self, message):
+        if self.scope['user'].is_authenticated:
+            await self.send({'type': 'websocket.accept'})
+        else:
+            await self.send({'type': 'websocket.close', 'code': 4001})
+
+    async def websocket_disconnect(self, message):
+        raise StopConsumer()
+
+
+class Command(BaseCommand):
+    help = "Замеряет число WebSocket-рукопожатий в секунду с AuthMiddlewareStack и CachedAuthMiddlewareStack"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connects', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=50)
+
+    def handle(self, *args, **options):
+        # Замер выполняется на временной тестовой базе, рабочие данные не затрагиваются
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            user = User.objects.create_user(username='bench_ws_user', password='bench-password')
+            client = Client()
+            client.force_login(user)
+            cookie = f"{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}"
+
+            stacks = [
+                ('AuthMiddlewareStack', AuthMiddlewareStack(ProbeConsumer.as_asgi())),
+                ('CachedAuthMiddlewareStack', CachedAuthMiddlewareStack(ProbeConsumer.as_asgi())),
+            ]
+            for label, application in stacks:
+                user_cache.clear()
+                rate = asyncio.run(self.run(application, cookie, options['connects'], options['concurrency']))
+                self.stdout.write(f"{label}: {rate:,.0f} соединений/с")
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    async def run(self, application, cookie, connects, concurrency):
+        headers = [(b'cookie', cookie.encode())]
+
+        async def connect_once():
+            communicator = WebsocketCommunicator(application, '/ws/bench/', headers=headers)
+            connected, _ = await communicator.connect()
+            if not connected:
+                raise RuntimeError("Соединение отклонено")
+            await communicator.disconnect()
+
+        # Прогрев: первое соединение заполняет кэш и соединение с базой
+        await connect_once()
+        started = time.perf_counter()
+        for start in range(0, connects, concurrency):
+            await asyncio.gather(*(connect_once() for _ in range(min(concurrency, connects - start))))
+        return connects / (time.perf_counter() - started)
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from chat.history import DEFAULT_BATCH_SIZE, compact_edit_history, get_max_versions
+
+
+class Command(BaseCommand):
+    help = "Удаляет версии истории изменений сверх лимита хранения на сообщение"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-versions', type=int, default=None,
+                            help="Сколько последних версий оставлять (по умолчанию CHAT_EDIT_HISTORY_MAX_VERSIONS)")
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help="Количество сообщений в одной транзакции")
+
+    def handle(self, *args, **options):
+        max_versions = options['max_versions']
+        if max_versions is None:
+            max_versions = get_max_versions()
+        if max_versions <= 0:
+            self.stdout.write("Лимит версий не задан, сжатие пропущено")
+            return
+
+        removed = compact_edit_history(max_versions=max_versions, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Удалено версий истории: {removed}"))
@@ -0,0 +1,48 @@
+import shutil
+import sys
+import zipfile
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.export import DEFAULT_CHUNK_SIZE, EXPORT_NAME, MEDIA_PREFIX, iter_chat_export, iter_media_names
+from chat.models import Chat
+
+
+class Command(BaseCommand):
+    help = "Экспортирует чат в NDJSON или ZIP-архив с медиафайлами"
+
+    def add_arguments(self, parser):
+        parser.add_argument('chat_id', type=int)
+        parser.add_argument('--output', '-o', help="Файл для записи (по умолчанию stdout, только для ndjson)")
+        parser.add_argument('--format', choices=['ndjson', 'zip'], default='ndjson')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                            help="Размер пачки при чтении из базы")
+
+    def handle(self, *args, **options):
+        chat = Chat.objects.filter(id=options['chat_id']).first()
+        if chat is None:
+            raise CommandError(f"Чат {options['chat_id']} не найден")
+        chunk_size = options['chunk_size']
+
+        if options['format'] == 'ndjson':
+            if options['output']:
+                with open(options['output'], 'w', encoding='utf-8') as output:
+                    output.writelines(iter_chat_export(chat, chunk_size=chunk_size, include_deleted=True))
+            else:
+                sys.stdout.writelines(iter_chat_export(chat, chunk_size=chunk_size, include_deleted=True))
+            return
+
+        if not options['output']:
+            raise CommandError("Для формата zip нужно указать --output")
+        with zipfile.ZipFile(options['output'], 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            with archive.open(EXPORT_NAME, 'w') as output:
+                for line in iter_chat_export(chat, chunk_size=chunk_size, include_deleted=True):
+                    output.write(line.encode('utf-8'))
+            for name in iter_media_names(chat, chunk_size=chunk_size):
+                if not default_storage.exists(name):
+                    self.stderr.write(f"Медиафайл не найден: {name}")
+                    continue
+                with default_storage.open(name, 'rb') as source, archive.open(MEDIA_PREFIX + name, 'w') as target:
+                    shutil.copyfileobj(source, target)
+        self.stderr.write(self.style.SUCCESS(f"Чат {chat.id} экспортирован в {options['output']}"))
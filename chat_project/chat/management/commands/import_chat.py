@@ -0,0 +1,66 @@
+import io
+import zipfile
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.archive import delete_media_files
+from chat.export import DEFAULT_CHUNK_SIZE, EXPORT_NAME, MEDIA_PREFIX, ChatImporter, ChatImportError
+
+
+class Command(BaseCommand):
+    help = "Загружает чат из NDJSON-файла или ZIP-архива, созданного export_chat"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                            help="Количество записей в одном bulk_create")
+        parser.add_argument('--create-users', action='store_true',
+                            help="Создавать отсутствующих пользователей (без пароля)")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            if zipfile.is_zipfile(path):
+                chat, importer = self.load_zip(path, options)
+            else:
+                importer = self.get_importer(options)
+                with open(path, encoding='utf-8') as lines:
+                    chat = importer.load(lines)
+        except (ChatImportError, KeyError, ValueError) as e:
+            raise CommandError(f"Ошибка импорта: {e}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Создан чат {chat.id} «{chat.name}», сообщений: {importer.messages}"
+        ))
+
+    def get_importer(self, options, media_loader=None):
+        return ChatImporter(
+            batch_size=options['batch_size'],
+            create_users=options['create_users'],
+            media_loader=media_loader,
+        )
+
+    def load_zip(self, path, options):
+        saved = []
+        with zipfile.ZipFile(path) as archive:
+            media = {name[len(MEDIA_PREFIX):] for name in archive.namelist() if name.startswith(MEDIA_PREFIX)}
+
+            def media_loader(name):
+                # Файлы без копии в архиве остаются ссылками как есть
+                if name not in media:
+                    return name
+                with archive.open(MEDIA_PREFIX + name) as source:
+                    saved.append(default_storage.save(name, File(source, name=name)))
+                return saved[-1]
+
+            importer = self.get_importer(options, media_loader=media_loader)
+            try:
+                with archive.open(EXPORT_NAME) as raw:
+                    chat = importer.load(io.TextIOWrapper(raw, encoding='utf-8'))
+            except Exception:
+                # Транзакция импорта откатилась, скопированные файлы больше никому не нужны
+                delete_media_files(saved)
+                raise
+        return chat, importer
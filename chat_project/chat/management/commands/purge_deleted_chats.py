@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from chat.models import Chat
+from chat.purge import DEFAULT_BATCH_SIZE, purge_chat
+
+
+class Command(BaseCommand):
+    help = "Окончательно удаляет чаты, помеченные как удалённые (если фоновый воркер их не обработал)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help="Количество сообщений в одной транзакции")
+
+    def handle(self, *args, **options):
+        chat_ids = list(Chat.all_objects.filter(is_deleted=True).order_by('id').values_list('id', flat=True))
+        for chat_id in chat_ids:
+            purged = purge_chat(chat_id, batch_size=options['batch_size'])
+            if purged is not None:
+                self.stdout.write(f"Чат {chat_id}: удалено {purged} сообщений")
+        self.stdout.write(self.style.SUCCESS(f"Обработано чатов: {len(chat_ids)}"))
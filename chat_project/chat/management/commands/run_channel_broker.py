@@ -0,0 +1,26 @@
+import asyncio
+import os
+
+from django.core.management.base import BaseCommand
+
+from chat.layers import UnixSocketBroker
+
+
+class Command(BaseCommand):
+    help = "Запускает брокер Unix-сокета для моста LocalChannelLayer между процессами"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/tmp/chat-broker.sock', help="Путь к Unix-сокету")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if os.path.exists(path):
+            os.unlink(path)
+        self.stdout.write(f"Брокер слушает {path}")
+        try:
+            asyncio.run(UnixSocketBroker(path).serve_forever())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if os.path.exists(path):
+                os.unlink(path)
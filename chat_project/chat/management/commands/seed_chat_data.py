@@ -0,0 +1,179 @@
+import random
+import time
+from bisect import bisect_right
+from datetime import timedelta
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from chat.bulk import preserve_timestamps
+from chat.models import Chat, Message, MessageEditHistory
+
+
+class Command(BaseCommand):
+    help = "Генерирует детерминированный набор тестовых данных: пользователи, чаты и сообщения"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100_000)
+        parser.add_argument('--chats', type=int, default=50_000)
+        parser.add_argument('--messages', type=int, default=50_000_000)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help="Количество строк в одной вставке")
+        parser.add_argument('--prefix', default='seed',
+                            help="Префикс имён пользователей и чатов")
+        parser.add_argument('--max-members', type=int, default=500,
+                            help="Максимальный размер группового чата")
+        parser.add_argument('--days', type=int, default=730,
+                            help="За сколько последних дней распределить сообщения")
+        parser.add_argument('--edit-ratio', type=float, default=0.05)
+        parser.add_argument('--delete-ratio', type=float, default=0.02)
+        parser.add_argument('--media-ratio', type=float, default=0.03)
+
+    def handle(self, *args, **options):
+        if options['users'] < 2 or options['chats'] < 1:
+            raise CommandError("Нужно как минимум 2 пользователя и 1 чат")
+        if User.objects.filter(username__startswith=f"{options['prefix']}_").exists():
+            raise CommandError(f"Пользователи с префиксом {options['prefix']}_ уже существуют")
+
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        started = time.monotonic()
+
+        with preserve_timestamps():
+            user_ids = self.create_users(options)
+            chats = self.create_chats(options, user_ids)
+            self.create_messages(options, chats)
+
+        self.stdout.write(self.style.SUCCESS(f"Готово за {time.monotonic() - started:.1f} с"))
+
+    def report(self, label, rows, started):
+        elapsed = max(time.monotonic() - started, 1e-6)
+        self.stdout.write(f"{label}: {rows} строк за {elapsed:.1f} с ({rows / elapsed:,.0f} строк/с)")
+
+    def create_users(self, options):
+        started = time.monotonic()
+        prefix = options['prefix']
+        # Хеш считается один раз: PBKDF2 на каждого пользователя занял бы часы
+        password = make_password(prefix)
+        now = timezone.now()
+        for start in range(0, options['users'], self.batch_size):
+            stop = min(start + self.batch_size, options['users'])
+            User.objects.bulk_create([
+                User(username=f"{prefix}_{n}", password=password, date_joined=now)
+                for n in range(start, stop)
+            ])
+        user_ids = list(
+            User.objects.filter(username__startswith=f"{prefix}_").order_by('id').values_list('id', flat=True)
+        )
+        self.report("Пользователи", len(user_ids), started)
+        return user_ids
+
+    def create_chats(self, options, user_ids):
+        """
+        Размеры чатов и популярность пользователей распределены по степенному закону:
+        большинство чатов личные, немногие группы очень большие, активные пользователи
+        состоят во многих чатах.
+        """
+        started = time.monotonic()
+        rng = self.rng
+        max_members = min(options['max_members'], len(user_ids))
+        popularity = list(accumulate(1.0 / (rank + 1) ** 0.8 for rank in range(len(user_ids))))
+        created_at = timezone.now() - timedelta(days=options['days'])
+
+        chats = []
+        through = Chat.members.through
+        table = connection.ops.quote_name(through._meta.db_table)
+        insert_sql = f"INSERT INTO {table} (chat_id, user_id) VALUES (%s, %s)"
+        rows = 0
+
+        for start in range(0, options['chats'], self.batch_size):
+            stop = min(start + self.batch_size, options['chats'])
+            specs = []
+            for n in range(start, stop):
+                size = min(max_members, max(2, int(rng.paretovariate(1.2)) + 1))
+                members = set()
+                while len(members) < size:
+                    members.add(user_ids[bisect_right(popularity, rng.random() * popularity[-1])])
+                members = sorted(members)
+                specs.append((n, members))
+
+            with transaction.atomic():
+                created = Chat.objects.bulk_create([
+                    Chat(
+                        name=f"{options['prefix']}_chat_{n}",
+                        is_group=len(members) > 2,
+                        admin_id=members[0] if len(members) > 2 else None,
+                        created_at=created_at,
+                    )
+                    for n, members in specs
+                ])
+                links = [(chat.id, user_id) for chat, (_, members) in zip(created, specs) for user_id in members]
+                # Прямая вставка в промежуточную таблицу без создания объектов модели
+                with connection.cursor() as cursor:
+                    cursor.executemany(insert_sql, links)
+
+            rows += len(created) + len(links)
+            chats.extend((chat.id, members) for chat, (_, members) in zip(created, specs))
+
+        self.report("Чаты и участники", rows, started)
+        return chats
+
+    def create_messages(self, options, chats):
+        """
+        Сообщения распределяются по чатам пропорционально числу участников,
+        даты равномерно растут от начала периода к текущему моменту.
+        """
+        started = time.monotonic()
+        rng = self.rng
+        total = options['messages']
+        activity = list(accumulate(len(members) for _, members in chats))
+        period_start = timezone.now() - timedelta(days=options['days'])
+        step = timedelta(days=options['days']) / max(total, 1)
+        rows = 0
+
+        for start in range(0, total, self.batch_size):
+            stop = min(start + self.batch_size, total)
+            messages = []
+            edit_counts = []
+            for n in range(start, stop):
+                chat_id, members = chats[bisect_right(activity, rng.random() * activity[-1])]
+                sender_id = rng.choice(members)
+                sent_at = period_start + step * n
+                is_deleted = rng.random() < options['delete_ratio']
+                edit_count = rng.randint(1, 3) if rng.random() < options['edit_ratio'] else 0
+                edit_counts.append(edit_count)
+                messages.append(Message(
+                    chat_id=chat_id,
+                    sender_id=sender_id,
+                    text=f"Сообщение {n} в чате {chat_id}",
+                    media=f"chat_media/{options['prefix']}/{n}.jpg" if rng.random() < options['media_ratio'] else None,
+                    created_at=sent_at,
+                    updated_at=sent_at + timedelta(minutes=edit_count),
+                    is_deleted=is_deleted,
+                    deleted_by_id=sender_id if is_deleted else None,
+                ))
+
+            with transaction.atomic():
+                Message.objects.bulk_create(messages)
+                edits = [
+                    MessageEditHistory(
+                        message_id=message.id,
+                        old_text=f"{message.text} (версия {version})",
+                        edited_by_id=message.sender_id,
+                        edited_at=message.created_at + timedelta(minutes=version + 1),
+                    )
+                    for message, edit_count in zip(messages, edit_counts)
+                    for version in range(edit_count)
+                ]
+                MessageEditHistory.objects.bulk_create(edits)
+
+            rows += len(messages) + len(edits)
+            if (start // self.batch_size) % 100 == 99:
+                self.report(f"Сообщения ({stop}/{total})", rows, started)
+
+        self.report("Сообщения и история изменений", rows, started)
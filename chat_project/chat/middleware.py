@@ -0,0 +1,146 @@
+import threading
+import time
+from collections import OrderedDict
+from importlib import import_module
+
+from channels.auth import get_user
+from channels.middleware import BaseMiddleware
+from channels.sessions import CookieMiddleware, SessionMiddleware
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+
+
+class CachedUser:
+    """
+    Облегчённый пользователь WebSocket-соединения: только id, имя и статус активности.
+    Сравнивается с экземплярами User по первичному ключу.
+    """
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, id, username, is_active=True):
+        self.id = id
+        self.username = username
+        self.is_active = is_active
+
+    @property
+    def pk(self):
+        return self.id
+
+    def __eq__(self, other):
+        if other is None or not getattr(other, 'is_authenticated', False):
+            return False
+        return self.id == getattr(other, 'pk', None)
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __str__(self):
+        return self.username
+
+
+class UserSessionCache:
+    """
+    Ограниченный по размеру кэш «ключ сессии → пользователь» с временем жизни записей.
+    Кэш локален для процесса; между процессами согласованность обеспечивает TTL.
+    """
+    def __init__(self, maxsize=10000, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._sessions_by_user = {}
+        self._lock = threading.Lock()
+
+    def get(self, session_key):
+        with self._lock:
+            entry = self._entries.get(session_key)
+            if entry is None:
+                return None
+            expires_at, user = entry
+            if expires_at < time.monotonic():
+                self._remove(session_key)
+                return None
+            self._entries.move_to_end(session_key)
+            return user
+
+    def set(self, session_key, user):
+        with self._lock:
+            self._remove(session_key)
+            self._entries[session_key] = (time.monotonic() + self.ttl, user)
+            self._sessions_by_user.setdefault(user.id, set()).add(session_key)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_session(self, session_key):
+        with self._lock:
+            self._remove(session_key)
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            for session_key in list(self._sessions_by_user.get(user_id, ())):
+                self._remove(session_key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sessions_by_user.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, session_key):
+        entry = self._entries.pop(session_key, None)
+        if entry is None:
+            return
+        user_id = entry[1].id
+        sessions = self._sessions_by_user.get(user_id)
+        if sessions is not None:
+            sessions.discard(session_key)
+            if not sessions:
+                del self._sessions_by_user[user_id]
+
+
+user_cache = UserSessionCache(
+    maxsize=getattr(settings, 'CHAT_WS_AUTH_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'CHAT_WS_AUTH_CACHE_TTL', 60),
+)
+
+
+class CachedAuthMiddleware(BaseMiddleware):
+    """
+    Аутентификация WebSocket-соединений с кэшированием пользователя по ключу сессии.
+    При попадании в кэш рукопожатие обходится без запросов к таблицам сессий и пользователей.
+    """
+    def __init__(self, inner, cache=None):
+        super().__init__(inner)
+        self.cache = cache or user_cache
+        self.session_store = import_module(settings.SESSION_ENGINE).SessionStore
+
+    async def __call__(self, scope, receive, send):
+        scope = dict(scope)
+        scope['user'] = await self.resolve_user(scope)
+        return await super().__call__(scope, receive, send)
+
+    async def resolve_user(self, scope):
+        session_key = scope.get('cookies', {}).get(settings.SESSION_COOKIE_NAME)
+        if not session_key:
+            return AnonymousUser()
+
+        user = self.cache.get(session_key)
+        if user is not None:
+            return user
+
+        # Промах: стандартная проверка сессии (включая хеш пароля) через channels
+        user = await get_user({'session': self.session_store(session_key)})
+        if not user.is_authenticated:
+            return user
+        user = CachedUser(user.pk, user.get_username(), user.is_active)
+        self.cache.set(session_key, user)
+        return user
+
+
+def CachedAuthMiddlewareStack(inner):
+    """
+    Замена AuthMiddlewareStack с кэшированием пользователя.
+    """
+    return CookieMiddleware(SessionMiddleware(CachedAuthMiddleware(inner)))
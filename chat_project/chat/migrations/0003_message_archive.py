@@ -0,0 +1,41 @@
+# Generated by Django 5.1.7 on 2026-10-19 14:22
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_chat_deleted_by_chat_is_deleted'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chat',
+            name='archive_after_days',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Архивировать сообщения старше (дней)'),
+        ),
+        migrations.CreateModel(
+            name='ArchivedMessage',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('text', models.TextField(blank=True, null=True, verbose_name='Текст сообщения')),
+                ('media', models.CharField(blank=True, default='', max_length=255, verbose_name='Медиафайл')),
+                ('created_at', models.DateTimeField(verbose_name='Дата отправки')),
+                ('updated_at', models.DateTimeField(verbose_name='Дата изменения')),
+                ('edit_history', models.JSONField(blank=True, default=list, verbose_name='История изменений')),
+                ('archived_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата архивации')),
+                ('chat', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_messages', to='chat.chat', verbose_name='Чат')),
+                ('sender', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_messages', to=settings.AUTH_USER_MODEL, verbose_name='Отправитель')),
+            ],
+            options={
+                'verbose_name': 'Архивное сообщение',
+                'verbose_name_plural': 'Архивные сообщения',
+                'ordering': ['created_at'],
+                'indexes': [models.Index(fields=['chat', 'id'], name='chat_archived_chat_id_idx')],
+            },
+        ),
+    ]
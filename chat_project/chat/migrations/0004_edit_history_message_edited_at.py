@@ -0,0 +1,19 @@
+# Generated by Django 5.1.7 on 2026-10-19 14:34
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_message_archive'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='messageedithistory',
+            index=models.Index(fields=['message', 'edited_at'], name='chat_edit_message_edited_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-19 14:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_edit_history_message_edited_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chat',
+            name='version',
+            field=models.BigIntegerField(default=0, editable=False, verbose_name='Версия содержимого'),
+        ),
+    ]
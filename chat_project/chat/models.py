@@ -1,7 +1,17 @@
+import os
+
 from django.db import models
 from django.contrib.auth.models import User
 
 
+class ChatManager(models.Manager):
+    """
+    Менеджер чатов, скрывающий удалённые чаты.
+    """
+    def get_queryset(self):
+        return super().get_queryset().filter(is_deleted=False)
+
+
 class Chat(models.Model):
     """
     Модель чата
@@ -13,6 +23,11 @@ class Chat(models.Model):
     is_deleted = models.BooleanField(default=False)
     deleted_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
     admin = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name="admin_chats", verbose_name="Администратор")
+    archive_after_days = models.PositiveIntegerField(null=True, blank=True, verbose_name="Архивировать сообщения старше (дней)")
+    version = models.BigIntegerField(default=0, editable=False, verbose_name="Версия содержимого")
+
+    objects = ChatManager()
+    all_objects = models.Manager()
 
     class Meta:
         verbose_name = "Чат"
@@ -22,6 +37,16 @@ class Chat(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        # Версию меняет только bump_chat_version: сохранение загруженного ранее
+        # экземпляра не должно откатывать её к устаревшему значению
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'version'
+            ]
+        super().save(*args, **kwargs)
+
 class Message(models.Model):
     """
     Модель сообщения в чате.
@@ -41,6 +66,23 @@ class Message(models.Model):
         ordering = ['created_at']
     def __str__(self):
         return f"Сообщение от {self.sender.username} в {self.chat.name}"
+
+    IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif'}
+    VIDEO_EXTENSIONS = {'.mp4', '.mov', '.avi'}
+
+    @property
+    def media_kind(self):
+        """
+        Тип вложения для шаблонов: image, video или file.
+        """
+        if not self.media:
+            return None
+        extension = os.path.splitext(self.media.name)[1].lower()
+        if extension in self.IMAGE_EXTENSIONS:
+            return 'image'
+        if extension in self.VIDEO_EXTENSIONS:
+            return 'video'
+        return 'file'
     
 class MessageEditHistory(models.Model):
     """
@@ -55,6 +97,35 @@ class MessageEditHistory(models.Model):
         verbose_name = "История изменения сообщения"
         verbose_name_plural = "История изменений сообщений"
         ordering = ['-edited_at']
+        indexes = [
+            models.Index(fields=['message', 'edited_at'], name='chat_edit_message_edited_idx'),
+        ]
+
+    def __str__(self):
+        return f"Изменение сообщения {self.message.id} пользователем {self.edited_by.username}"
+
+class ArchivedMessage(models.Model):
+    """
+    Архивная копия сообщения, перенесённая из горячей таблицы командой archive_messages.
+    Первичный ключ совпадает с id исходного сообщения.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    chat = models.ForeignKey(Chat, on_delete=models.CASCADE, related_name="archived_messages", verbose_name="Чат")
+    sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name="archived_messages", verbose_name="Отправитель")
+    text = models.TextField(verbose_name="Текст сообщения", blank=True, null=True)
+    media = models.CharField(max_length=255, blank=True, default="", verbose_name="Медиафайл")
+    created_at = models.DateTimeField(verbose_name="Дата отправки")
+    updated_at = models.DateTimeField(verbose_name="Дата изменения")
+    edit_history = models.JSONField(default=list, blank=True, verbose_name="История изменений")
+    archived_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата архивации")
+
+    class Meta:
+        verbose_name = "Архивное сообщение"
+        verbose_name_plural = "Архивные сообщения"
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['chat', 'id'], name='chat_archived_chat_id_idx'),
+        ]
 
     def __str__(self):
-        return f"Изменение сообщения {self.message.id} пользователем {self.edited_by.username}"
\ No newline at end of file
+        return f"Архивное сообщение {self.id} в чате {self.chat_id}"
@@ -0,0 +1,61 @@
+from django.db import transaction
+
+from .archive import delete_media_files
+from .models import Chat, Message, MessageEditHistory, ArchivedMessage
+
+# Имя канала фонового воркера (python manage.py runworker chat-purge)
+PURGE_CHANNEL = 'chat-purge'
+DEFAULT_BATCH_SIZE = 500
+
+
+def purge_chat(chat_id, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Окончательное удаление удалённого чата вместе с сообщениями, историей изменений и медиафайлами.
+    Данные удаляются пачками в коротких транзакциях, чтобы не блокировать базу надолго.
+    Возвращает количество удалённых сообщений или None, если чат не найден или не помечен как удалённый.
+    """
+    chat = Chat.all_objects.filter(id=chat_id, is_deleted=True).first()
+    if chat is None:
+        return None
+
+    purged = 0
+    while True:
+        batch = list(
+            Message.objects.filter(chat_id=chat_id)
+                           .order_by('id')
+                           .values_list('id', 'media')[:batch_size]
+        )
+        if not batch:
+            break
+        ids = [message_id for message_id, _ in batch]
+        media = [name for _, name in batch if name]
+
+        with transaction.atomic():
+            MessageEditHistory.objects.filter(message_id__in=ids).delete()
+            Message.objects.filter(id__in=ids).delete()
+            transaction.on_commit(lambda media=media: delete_media_files(media))
+
+        purged += len(ids)
+
+    while True:
+        batch = list(
+            ArchivedMessage.objects.filter(chat_id=chat_id)
+                                   .order_by('id')
+                                   .values_list('id', 'media')[:batch_size]
+        )
+        if not batch:
+            break
+        ids = [message_id for message_id, _ in batch]
+        media = [name for _, name in batch if name]
+
+        with transaction.atomic():
+            ArchivedMessage.objects.filter(id__in=ids).delete()
+            transaction.on_commit(lambda media=media: delete_media_files(media))
+
+        purged += len(ids)
+
+    with transaction.atomic():
+        chat.members.clear()
+        chat.delete()
+
+    return purged
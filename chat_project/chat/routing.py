@@ -1,5 +1,6 @@
 from django.urls import re_path
 from . import consumers
+from .purge import PURGE_CHANNEL
 
 # Список WebSocket URL-шаблонов для маршрутизации соединений
 websocket_urlpatterns = [
@@ -9,4 +10,11 @@ websocket_urlpatterns = [
     #   - (?P<chat_id>\w+) - именованная группа, захватывающая ID чата (состоящий из буквенно-цифровых символов)
     # as_asgi() - преобразует consumer в ASGI-приложение
     re_path(r'ws/chat/(?P<chat_id>\w+)/$', consumers.ChatConsumer.as_asgi()),
-]
\ No newline at end of file
+    # Мультиплексированное соединение: подписка на несколько чатов через один сокет
+    re_path(r'ws/stream/$', consumers.StreamConsumer.as_asgi()),
+]
+
+# Фоновые воркеры (python manage.py runworker <имя канала>)
+channel_routes = {
+    PURGE_CHANNEL: consumers.ChatPurgeConsumer.as_asgi(),
+}
@@ -0,0 +1,71 @@
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_out
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .middleware import user_cache
+from .models import Chat, Message
+from .versions import bump_chat_version, bump_members_version
+
+
+@receiver(user_logged_out)
+def invalidate_session_on_logout(sender, request, user, **kwargs):
+    """
+    Выход из аккаунта: сессия больше не должна открывать WebSocket-соединения.
+    """
+    session_key = getattr(getattr(request, 'session', None), 'session_key', None)
+    if session_key:
+        user_cache.invalidate_session(session_key)
+    if user is not None:
+        user_cache.invalidate_user(user.pk)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_sessions(sender, instance, **kwargs):
+    """
+    Смена пароля, блокировка или удаление пользователя сбрасывают его записи в кэше.
+    """
+    # Обновление last_login при входе не меняет данных, попадающих в кэш
+    if kwargs.get('update_fields') == frozenset({'last_login'}):
+        return
+    user_cache.invalidate_user(instance.pk)
+
+
+@receiver(m2m_changed, sender=Chat.members.through)
+def invalidate_members_fragment(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Изменение состава участников сбрасывает кэшированный список участников и версию чата.
+    """
+    if reverse and action == 'pre_clear':
+        # После очистки связей со стороны пользователя список его чатов уже не получить
+        instance._cleared_chat_ids = list(instance.chats.values_list('id', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        chat_ids = [instance.pk]
+    elif action == 'post_clear':
+        chat_ids = getattr(instance, '_cleared_chat_ids', ())
+    else:
+        chat_ids = pk_set or ()
+    for chat_id in chat_ids:
+        bump_members_version(chat_id)
+        bump_chat_version(chat_id)
+
+
+@receiver(post_save, sender=Chat)
+def invalidate_chat_version(sender, instance, **kwargs):
+    """
+    Изменение чата (название, администратор, удаление) меняет версию его содержимого.
+    """
+    bump_chat_version(instance.pk)
+
+
+@receiver(post_save, sender=Message)
+def invalidate_message_chat_version(sender, instance, **kwargs):
+    """
+    Новое, отредактированное или удалённое сообщение меняет версию чата.
+    Массовые операции (архивация, очистка) обновляют версию сами.
+    """
+    bump_chat_version(instance.chat_id)
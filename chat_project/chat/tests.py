@@ -1,3 +1,1041 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import tempfile
+import time
+import uuid
+import zipfile
+from datetime import timedelta
+from email.utils import parsedate_to_datetime
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.exceptions import ChannelFull
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .bulk import preserve_timestamps
+from .export import ChatImporter, ChatImportError, aiter_chat_export, iter_chat_export
+from .archive import archive_chat_messages, purge_deleted_messages
+from .consumers import StreamConsumer
+from .history import compact_edit_history, get_history_summary
+from .layers import LocalChannelLayer, UnixSocketBroker
+from .middleware import CachedAuthMiddleware, CachedAuthMiddlewareStack, CachedUser, UserSessionCache, user_cache
+from .models import ArchivedMessage, Chat, Message, MessageEditHistory
+from .purge import purge_chat
+from .routing import websocket_urlpatterns
+from .versions import get_members_version
+
+# Версии состава участников и фрагменты шаблонов кэшируются; тестам не нужен Redis
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+LOCAL_CHANNEL_LAYERS = {'default': {'BACKEND': 'chat.layers.LocalChannelLayer'}}
+# Тесты моста через Redis выполняются, только если сервер доступен
+REDIS_TEST_URL = os.environ.get('CHAT_TEST_REDIS_URL', 'redis://127.0.0.1:6379/15')
+
+
+def redis_available():
+    try:
+        import redis
+        redis.Redis.from_url(REDIS_TEST_URL, socket_connect_timeout=0.2).ping()
+    except Exception:
+        return False
+    return True
+
+
+async def wait_for(condition, timeout=2.0):
+    """
+    Ожидание условия, которое выполняется асинхронно (например, обработки кадра брокером).
+    """
+    async def poll():
+        while not condition():
+            await asyncio.sleep(0.01)
+    await asyncio.wait_for(poll(), timeout)
+
+
+class LocalChannelLayerTests(SimpleTestCase):
+    """
+    Внутрипроцессная доставка без моста.
+    """
+    async def test_group_send_delivers_copy_to_each_member(self):
+        layer = LocalChannelLayer()
+        first = await layer.new_channel()
+        second = await layer.new_channel()
+        await layer.group_add('chat_1', first)
+        await layer.group_add('chat_1', second)
+
+        await layer.group_send('chat_1', {'type': 'chat_message', 'text': 'привет'})
+        received_first = await layer.receive(first)
+        received_second = await layer.receive(second)
+
+        self.assertEqual(received_first, {'type': 'chat_message', 'text': 'привет'})
+        self.assertEqual(received_second, received_first)
+        received_first['text'] = 'изменено'
+        self.assertEqual(received_second['text'], 'привет')
+
+    async def test_group_discard_stops_delivery(self):
+        layer = LocalChannelLayer()
+        channel = await layer.new_channel()
+        await layer.group_add('chat_1', channel)
+        await layer.group_discard('chat_1', channel)
+
+        await layer.group_send('chat_1', {'type': 'chat_message'})
+        self.assertNotIn(channel, layer.channels)
+        self.assertNotIn('chat_1', layer.groups)
+
+    async def test_expired_messages_are_dropped(self):
+        layer = LocalChannelLayer(expiry=0.01)
+        layer.clean_interval = 0
+        channel = await layer.new_channel()
+        await layer.group_add('chat_1', channel)
+        await layer.send(channel, {'type': 'old'})
+        await asyncio.sleep(0.05)
+
+        await layer.group_send('chat_2', {'type': 'trigger'})
+        self.assertNotIn(channel, layer.channels)
+        # Канал с просроченным сообщением исключается из групп
+        self.assertNotIn(channel, layer.groups.get('chat_1', {}))
+
+    async def test_capacity_limits_channel(self):
+        layer = LocalChannelLayer(capacity=2)
+        channel = await layer.new_channel()
+        await layer.group_add('chat_1', channel)
+        await layer.send(channel, {'type': 'first'})
+        await layer.send(channel, {'type': 'second'})
+
+        with self.assertRaises(ChannelFull):
+            await layer.send(channel, {'type': 'third'})
+        # Переполненный участник группы не мешает рассылке
+        await layer.group_send('chat_1', {'type': 'fourth'})
+        self.assertEqual((await layer.receive(channel))['type'], 'first')
+
+    async def test_named_channel_reaches_local_listener(self):
+        layer = LocalChannelLayer()
+        receiving = asyncio.ensure_future(layer.receive('chat-purge'))
+        await wait_for(lambda: 'chat-purge' in layer.listening)
+
+        await layer.send('chat-purge', {'type': 'purge_chat', 'chat_id': 1})
+        self.assertEqual(await asyncio.wait_for(receiving, 1), {'type': 'purge_chat', 'chat_id': 1})
+
+    async def test_named_channel_without_listener_is_dropped(self):
+        layer = LocalChannelLayer(capacity=2)
+        with self.assertLogs('chat.layers', level='WARNING'):
+            for chat_id in range(5):
+                await layer.send('chat-purge', {'type': 'purge_chat', 'chat_id': chat_id})
+        self.assertNotIn('chat-purge', layer.channels)
+
+
+class UnixSocketBridgeTests(SimpleTestCase):
+    """
+    Доставка между экземплярами слоя через UnixSocketBroker.
+    """
+    async def start_broker(self):
+        self.directory = tempfile.TemporaryDirectory()
+        path = os.path.join(self.directory.name, 'broker.sock')
+        self.broker = await UnixSocketBroker(path).start()
+        bridge = {'transport': 'chat.layers.UnixSocketTransport', 'path': path}
+        self.web = LocalChannelLayer(bridge=bridge)
+        self.worker = LocalChannelLayer(bridge=bridge)
+
+    async def stop_broker(self):
+        await self.web.close()
+        await self.worker.close()
+        await self.broker.close()
+        self.directory.cleanup()
+
+    async def run_with_broker(self, test):
+        # Брокер и слои живут в цикле событий конкретного теста
+        await self.start_broker()
+        try:
+            await test()
+        finally:
+            await self.stop_broker()
+
+    async def test_group_send_reaches_other_process(self):
+        async def test():
+            channel = await self.worker.new_channel()
+            await self.worker.group_add('chat_1', channel)
+            await wait_for(lambda: 'chat_1' in self.broker.groups)
+
+            await self.web.group_send('chat_1', {'type': 'chat_message', 'text': 'привет'})
+            received = await asyncio.wait_for(self.worker.receive(channel), 2)
+            self.assertEqual(received, {'type': 'chat_message', 'text': 'привет'})
+        await self.run_with_broker(test)
+
+    async def test_specific_channel_reaches_owner(self):
+        async def test():
+            channel = await self.worker.new_channel()
+            receiving = asyncio.ensure_future(self.worker.receive(channel))
+            await wait_for(lambda: self.worker.process_id in self.broker.processes)
+
+            await self.web.send(channel, {'type': 'direct'})
+            self.assertEqual(await asyncio.wait_for(receiving, 2), {'type': 'direct'})
+        await self.run_with_broker(test)
+
+    async def test_named_channel_routed_to_listener(self):
+        async def test():
+            receiving = asyncio.ensure_future(self.worker.receive('chat-purge'))
+            await wait_for(lambda: 'chat-purge' in self.broker.listeners)
+
+            await self.web.send('chat-purge', {'type': 'purge_chat', 'chat_id': 7})
+            self.assertEqual(await asyncio.wait_for(receiving, 2), {'type': 'purge_chat', 'chat_id': 7})
+        await self.run_with_broker(test)
+
+    async def test_missing_broker_keeps_local_delivery(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'broker.sock')
+            layer = LocalChannelLayer(bridge={'transport': 'chat.layers.UnixSocketTransport', 'path': path})
+            channel = await layer.new_channel()
+            with self.assertLogs('chat.layers', 'WARNING') as logs:
+                await layer.group_add('chat_1', channel)
+                await layer.group_send('chat_1', {'type': 'chat_message', 'text': 'привет'})
+                self.assertEqual(await layer.receive(channel), {'type': 'chat_message', 'text': 'привет'})
+            self.assertIn('subscribe', logs.output[0])
+
+            # Когда брокер появляется, подписка восстанавливается при переподключении
+            broker = await UnixSocketBroker(path).start()
+            try:
+                receiving = asyncio.ensure_future(layer.receive(channel))
+                await wait_for(lambda: 'chat_1' in broker.groups)
+                receiving.cancel()
+            finally:
+                await layer.close()
+                await broker.close()
+
+
+@skipUnless(redis_available(), "Redis недоступен")
+class RedisBridgeTests(SimpleTestCase):
+    """
+    Доставка между экземплярами слоя через RedisPubSubTransport.
+    """
+    async def run_with_layers(self, test):
+        bridge = {
+            'transport': 'chat.layers.RedisPubSubTransport',
+            'url': REDIS_TEST_URL,
+            'prefix': f'chat-layer-test-{uuid.uuid4().hex}:',
+        }
+        self.web = LocalChannelLayer(bridge=bridge)
+        self.worker = LocalChannelLayer(bridge=bridge)
+        try:
+            await test()
+        finally:
+            await self.web.close()
+            await self.worker.close()
+
+    async def test_group_send_reaches_other_process(self):
+        async def test():
+            channel = await self.worker.new_channel()
+            await self.worker.group_add('chat_1', channel)
+
+            await self.web.group_send('chat_1', {'type': 'chat_message', 'text': 'привет'})
+            received = await asyncio.wait_for(self.worker.receive(channel), 2)
+            self.assertEqual(received, {'type': 'chat_message', 'text': 'привет'})
+        await self.run_with_layers(test)
+
+    async def test_group_send_published_only_with_remote_interest(self):
+        async def test():
+            local = await self.web.new_channel()
+            await self.web.group_add('chat_1', local)
+            with mock.patch.object(self.web.bridge._client, 'publish', wraps=self.web.bridge._client.publish) as publish:
+                await self.web.group_send('chat_1', {'type': 'chat_message'})
+                publish.assert_not_called()
+
+                remote = await self.worker.new_channel()
+                await self.worker.group_add('chat_1', remote)
+                await wait_for(lambda: self.web.bridge.remote_groups['chat_1'])
+                await self.web.group_send('chat_1', {'type': 'chat_message'})
+                self.assertEqual(publish.call_count, 1)
+
+                await self.worker.group_discard('chat_1', remote)
+                await wait_for(lambda: not self.web.bridge.remote_groups['chat_1'])
+                await self.web.group_send('chat_1', {'type': 'chat_message'})
+                self.assertEqual(publish.call_count, 1)
+        await self.run_with_layers(test)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class EditHistoryTests(TestCase):
+    """
+    Сводка истории изменений и сжатие по лимиту версий.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('author')
+        cls.outsider = User.objects.create_user('outsider')
+        cls.chat = Chat.objects.create(name='chat')
+        cls.chat.members.add(cls.user)
+        cls.other_chat = Chat.objects.create(name='other')
+        cls.other_chat.members.add(cls.outsider)
+
+    def create_message(self, chat, sender, edits):
+        message = Message.objects.create(chat=chat, sender=sender, text='текущий')
+        started = timezone.now() - timedelta(days=1)
+        with preserve_timestamps():
+            MessageEditHistory.objects.bulk_create([
+                MessageEditHistory(message=message, old_text=f'версия {n}', edited_by=sender,
+                                   edited_at=started + timedelta(minutes=n))
+                for n in range(edits)
+            ])
+        return message
+
+    def remaining_versions(self, message):
+        return list(MessageEditHistory.objects.filter(message=message)
+                                              .order_by('-edited_at')
+                                              .values_list('old_text', flat=True))
+
+    def test_summary_returns_count_and_latest_versions(self):
+        edited = self.create_message(self.chat, self.user, edits=5)
+        unedited = self.create_message(self.chat, self.user, edits=0)
+        foreign = self.create_message(self.other_chat, self.outsider, edits=3)
+
+        with self.assertNumQueries(1):
+            summary = get_history_summary(self.user, [edited.id, unedited.id, foreign.id], versions=2)
+
+        self.assertEqual(list(summary), [edited.id])
+        self.assertEqual(summary[edited.id]['edit_count'], 5)
+        self.assertEqual([version['old_text'] for version in summary[edited.id]['versions']],
+                         ['версия 4', 'версия 3'])
+        self.assertEqual(summary[edited.id]['versions'][0]['edited_by'], 'author')
+
+    def test_compaction_keeps_latest_versions(self):
+        first = self.create_message(self.chat, self.user, edits=5)
+        second = self.create_message(self.chat, self.user, edits=4)
+        short = self.create_message(self.chat, self.user, edits=2)
+
+        removed = compact_edit_history(max_versions=3, batch_size=1)
+
+        self.assertEqual(removed, 3)
+        self.assertEqual(self.remaining_versions(first), ['версия 4', 'версия 3', 'версия 2'])
+        self.assertEqual(self.remaining_versions(second), ['версия 3', 'версия 2', 'версия 1'])
+        self.assertEqual(self.remaining_versions(short), ['версия 1', 'версия 0'])
+        self.assertEqual(compact_edit_history(max_versions=3, batch_size=1), 0)
+
+    def test_zero_limit_disables_compaction(self):
+        message = self.create_message(self.chat, self.user, edits=4)
+        self.assertEqual(compact_edit_history(max_versions=0), 0)
+        self.assertEqual(len(self.remaining_versions(message)), 4)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, CHAT_ARCHIVE_AFTER_DAYS=365, CHAT_PURGE_DELETED_AFTER_DAYS=30)
+class ArchiveTests(TestCase):
+    """
+    Перенос старых сообщений в архив, очистка удалённых и чтение истории через границу архива.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('author', password='p')
+        cls.chat = Chat.objects.create(name='chat')
+        cls.chat.members.add(cls.user)
+
+    def create_message(self, days_ago, text='текст', chat=None, is_deleted=False):
+        created = timezone.now() - timedelta(days=days_ago)
+        with preserve_timestamps():
+            [message] = Message.objects.bulk_create([
+                Message(chat=chat or self.chat, sender=self.user, text=text, is_deleted=is_deleted,
+                        created_at=created, updated_at=created)
+            ])
+        return message
+
+    def test_chat_setting_overrides_default_period(self):
+        short = Chat.objects.create(name='short', archive_after_days=7)
+        old_in_short = self.create_message(10, chat=short)
+        old_in_default = self.create_message(10)
+
+        self.assertEqual(archive_chat_messages(short), 1)
+        self.assertEqual(archive_chat_messages(self.chat), 0)
+        self.assertTrue(ArchivedMessage.objects.filter(id=old_in_short.id).exists())
+        self.assertTrue(Message.objects.filter(id=old_in_default.id).exists())
+
+    def test_edit_history_moves_into_archive(self):
+        message = self.create_message(400, text='новый')
+        edited_at = timezone.now() - timedelta(days=399)
+        with preserve_timestamps():
+            MessageEditHistory.objects.bulk_create([
+                MessageEditHistory(message=message, old_text=f'версия {n}', edited_by=self.user,
+                                   edited_at=edited_at + timedelta(minutes=n))
+                for n in range(2)
+            ])
+
+        self.assertEqual(archive_chat_messages(self.chat), 1)
+
+        archived = ArchivedMessage.objects.get(id=message.id)
+        self.assertEqual(archived.text, 'новый')
+        self.assertEqual([edit['old_text'] for edit in archived.edit_history], ['версия 1', 'версия 0'])
+        self.assertEqual(archived.edit_history[0]['edited_by'], self.user.id)
+        self.assertFalse(MessageEditHistory.objects.filter(message_id=message.id).exists())
+
+    def test_deleted_messages_purged_after_grace_period(self):
+        deleted = self.create_message(400, is_deleted=True)
+        # Удаление обновляет updated_at, льготный период отсчитывается от него
+        Message.objects.filter(id=deleted.id).update(updated_at=timezone.now() - timedelta(days=10))
+
+        self.assertEqual(archive_chat_messages(self.chat), 0)
+        self.assertFalse(ArchivedMessage.objects.filter(id=deleted.id).exists())
+        self.assertEqual(purge_deleted_messages(), 0)
+        self.assertTrue(Message.objects.filter(id=deleted.id).exists())
+
+        self.assertEqual(purge_deleted_messages(now=timezone.now() + timedelta(days=21)), 1)
+        self.assertFalse(Message.objects.filter(id=deleted.id).exists())
+
+    def test_pagination_crosses_archive_boundary(self):
+        old = [self.create_message(400 - n, text=f'старое {n}') for n in range(4)]
+        self.create_message(10, is_deleted=True)
+        recent = [self.create_message(10 - n, text=f'новое {n}') for n in range(3)]
+        archive_chat_messages(self.chat)
+        self.assertEqual(ArchivedMessage.objects.count(), 4)
+
+        self.client.login(username='author', password='p')
+        url = reverse('chat_messages', args=[self.chat.id])
+        received = []
+        before = None
+        while True:
+            params = {'limit': 2}
+            if before is not None:
+                params['before'] = before
+            data = self.client.get(url, params).json()
+            if not data['messages']:
+                break
+            received.extend(data['messages'])
+            before = data['next_before']
+
+        expected = [message.id for message in reversed(old + recent)]
+        self.assertEqual([message['message_id'] for message in received], expected)
+        self.assertEqual([message['archived'] for message in received], [False] * 3 + [True] * 4)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ConditionalGetTests(TestCase):
+    """
+    Ответы 304 для истории чата и истории изменений сообщения.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('member')
+        cls.chat = Chat.objects.create(name='chat')
+        cls.chat.members.add(cls.user)
+        cls.message = Message.objects.create(chat=cls.chat, sender=cls.user, text='первое')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.messages_url = reverse('chat_messages', args=[self.chat.id])
+
+    def test_unchanged_chat_answers_304_without_heavy_queries(self):
+        response = self.client.get(self.messages_url)
+        self.assertEqual(response.status_code, 200)
+
+        # Сессия, пользователь и версия чата с проверкой участия
+        with self.assertNumQueries(3):
+            cached = self.client.get(self.messages_url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+
+    def test_change_within_same_second_invalidates_last_modified(self):
+        Chat.all_objects.filter(pk=self.chat.pk).update(version=int(time.time()))
+        response = self.client.get(self.messages_url)
+        Message.objects.create(chat=self.chat, sender=self.user, text='второе')
+
+        by_date = self.client.get(self.messages_url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(by_date.status_code, 200)
+        self.assertNotEqual(by_date.get('Last-Modified'), response['Last-Modified'])
+        by_etag = self.client.get(self.messages_url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(by_etag.status_code, 200)
+
+    def test_archiving_changes_chat_version(self):
+        version = Chat.objects.get(pk=self.chat.pk).version
+        Message.objects.filter(pk=self.message.pk).update(created_at=timezone.now() - timedelta(days=400))
+
+        self.assertEqual(archive_chat_messages(self.chat), 1)
+        self.assertGreater(Chat.objects.get(pk=self.chat.pk).version, version)
+
+    def test_saving_stale_chat_keeps_version(self):
+        stale = Chat.objects.get(pk=self.chat.pk)
+        Message.objects.create(chat=self.chat, sender=self.user, text='второе')
+        version = Chat.objects.get(pk=self.chat.pk).version
+
+        stale.name = 'переименован'
+        stale.save()
+        self.assertGreater(Chat.objects.get(pk=self.chat.pk).version, version)
+
+    def test_message_history_etag_follows_edits_and_compaction(self):
+        url = reverse('message_history', args=[self.message.id])
+        with preserve_timestamps():
+            MessageEditHistory.objects.bulk_create([
+                MessageEditHistory(message=self.message, old_text=f'версия {n}', edited_by=self.user,
+                                   edited_at=timezone.now() - timedelta(minutes=10 - n))
+                for n in range(3)
+            ])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        compact_edit_history(max_versions=1)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_last_modified_never_ahead_of_clock(self):
+        # Поток изменений быстрее раза в секунду уводит версию вперёд часов
+        for n in range(5):
+            Message.objects.create(chat=self.chat, sender=self.user, text=f'быстрое {n}')
+        Chat.all_objects.filter(pk=self.chat.pk).update(version=int(time.time()) + 3600)
+
+        response = self.client.get(self.messages_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Last-Modified'))
+        self.assertEqual(self.client.get(self.messages_url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        Chat.all_objects.filter(pk=self.chat.pk).update(version=int(time.time()) - 10)
+        response = self.client.get(self.messages_url)
+        self.assertLessEqual(parsedate_to_datetime(response['Last-Modified']).timestamp(), time.time())
+
+    def test_non_member_gets_no_etag(self):
+        self.client.force_login(User.objects.create_user('stranger'))
+        response = self.client.get(self.messages_url)
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_chat_page_not_reused_after_relogin(self):
+        self.user.set_password('secret')
+        self.user.save()
+        self.client.logout()
+        url = reverse('chat_detail', args=[self.chat.id])
+        credentials = {'username': 'member', 'password': 'secret'}
+
+        self.client.post('/login/', credentials)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        self.client.get('/logout/')
+        self.client.post('/login/', credentials)
+        # Новый CSRF-секрет — страница отрисовывается заново с новым токеном
+        relogged = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(relogged.status_code, 200)
+        self.assertFalse(relogged.has_header('Last-Modified'))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ChatExportTests(TestCase):
+    """
+    Выгрузка и загрузка чатов.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author')
+        cls.reader = User.objects.create_user('reader')
+        cls.chat = Chat.objects.create(name='export', is_group=True, admin=cls.author)
+        cls.chat.members.add(cls.author, cls.reader)
+        cls.visible = Message.objects.create(chat=cls.chat, sender=cls.author, text='видно всем')
+        cls.deleted = Message.objects.create(chat=cls.chat, sender=cls.author, text='удалено автором',
+                                             is_deleted=True, deleted_by=cls.author)
+
+    def exported_texts(self, lines):
+        records = [json.loads(line) for line in lines]
+        return [record['text'] for record in records if record['type'] == 'message']
+
+    def test_member_export_hides_deleted_messages(self):
+        self.client.force_login(self.reader)
+        response = self.client.get(reverse('export_chat', args=[self.chat.id]))
+        self.assertEqual(response.status_code, 200)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(self.exported_texts(lines), ['видно всем'])
+
+    def test_full_dump_includes_deleted_messages(self):
+        lines = list(iter_chat_export(self.chat, include_deleted=True))
+        self.assertEqual(self.exported_texts(lines), ['видно всем', 'удалено автором'])
+
+    def comparable(self, lines):
+        """
+        Записи экспорта без полей, которые при загрузке создаются заново.
+        """
+        records = []
+        for line in lines:
+            record = json.loads(line)
+            record.pop('id', None)
+            record.pop('archived', None)
+            records.append(record)
+        return records
+
+    def test_ndjson_round_trip(self):
+        with preserve_timestamps():
+            MessageEditHistory.objects.bulk_create([
+                MessageEditHistory(message=self.visible, old_text='черновик', edited_by=self.author,
+                                   edited_at=timezone.now() - timedelta(minutes=1)),
+            ])
+        lines = list(iter_chat_export(self.chat, include_deleted=True))
+
+        imported = ChatImporter(batch_size=1).load(lines)
+
+        self.assertNotEqual(imported.id, self.chat.id)
+        self.assertEqual(self.comparable(iter_chat_export(imported, include_deleted=True)), self.comparable(lines))
+
+    def test_async_export_matches_sync(self):
+        async def collect():
+            return [line async for line in aiter_chat_export(self.chat, chunk_size=1, include_deleted=True)]
+
+        self.assertEqual(async_to_sync(collect)(), list(iter_chat_export(self.chat, include_deleted=True)))
+
+    def test_zip_round_trip_copies_media(self):
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            name = default_storage.save('chat_media/photo.jpg', ContentFile(b'image'))
+            Message.objects.create(chat=self.chat, sender=self.reader, text='фото', media=name)
+            path = os.path.join(media_root, 'export.zip')
+            call_command('export_chat', self.chat.id, format='zip', output=path, stderr=io.StringIO())
+            with zipfile.ZipFile(path) as archive:
+                self.assertIn('media/' + name, archive.namelist())
+            default_storage.delete(name)
+
+            call_command('import_chat', path, stdout=io.StringIO())
+
+            imported = Chat.objects.exclude(id=self.chat.id).get(name='export')
+            message = imported.messages.get(text='фото')
+            with default_storage.open(message.media.name) as media:
+                self.assertEqual(media.read(), b'image')
+            self.assertEqual(self.comparable(iter_chat_export(imported, include_deleted=True)),
+                             self.comparable(iter_chat_export(self.chat, include_deleted=True)))
+
+    def test_failed_import_leaves_nothing_behind(self):
+        lines = list(iter_chat_export(self.chat, include_deleted=True))
+        broken = json.loads(lines[-1])
+        broken['sender'] = 'unknown'
+        chats = Chat.all_objects.count()
+        messages = Message.objects.count()
+
+        with self.assertRaises(ChatImportError):
+            ChatImporter(batch_size=1).load(lines + [json.dumps(broken)])
+
+        self.assertEqual(Chat.all_objects.count(), chats)
+        self.assertEqual(Message.objects.count(), messages)
+
+
+class UserSessionCacheTests(SimpleTestCase):
+    """
+    Ограничения размера и времени жизни кэша пользователей.
+    """
+    def test_entries_expire_after_ttl(self):
+        cache = UserSessionCache(ttl=60)
+        with mock.patch('chat.middleware.time.monotonic', return_value=1000.0):
+            cache.set('session', CachedUser(1, 'user'))
+        with mock.patch('chat.middleware.time.monotonic', return_value=1059.0):
+            self.assertEqual(cache.get('session').username, 'user')
+        with mock.patch('chat.middleware.time.monotonic', return_value=1061.0):
+            self.assertIsNone(cache.get('session'))
+        self.assertEqual(len(cache), 0)
+
+    def test_size_never_exceeds_maxsize(self):
+        cache = UserSessionCache(maxsize=2)
+        cache.set('first', CachedUser(1, 'first'))
+        cache.set('second', CachedUser(2, 'second'))
+        # Обращение делает запись самой свежей, вытесняется давно не использованная
+        cache.get('first')
+        cache.set('third', CachedUser(3, 'third'))
+
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('second'))
+        self.assertIsNotNone(cache.get('first'))
+        self.assertIsNotNone(cache.get('third'))
+
+    def test_invalidate_user_removes_all_sessions(self):
+        cache = UserSessionCache()
+        cache.set('desktop', CachedUser(1, 'user'))
+        cache.set('phone', CachedUser(1, 'user'))
+        cache.set('other', CachedUser(2, 'other'))
+
+        cache.invalidate_user(1)
+        self.assertIsNone(cache.get('desktop'))
+        self.assertIsNone(cache.get('phone'))
+        self.assertIsNotNone(cache.get('other'))
+
+
+@override_settings(CACHES=LOCMEM_CACHES, CHANNEL_LAYERS=LOCAL_CHANNEL_LAYERS)
+class CachedAuthMiddlewareTests(TestCase):
+    """
+    Аутентификация WebSocket-соединений через кэш пользователей.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('member', password='secret')
+        cls.chat = Chat.objects.create(name='chat')
+        cls.chat.members.add(cls.user)
+
+    def setUp(self):
+        user_cache.clear()
+        self.addCleanup(user_cache.clear)
+        self.client.force_login(self.user)
+        self.session_key = self.client.cookies[settings.SESSION_COOKIE_NAME].value
+
+    def scope(self, session_key):
+        return {'type': 'websocket', 'cookies': {settings.SESSION_COOKIE_NAME: session_key}}
+
+    def test_cache_hit_makes_no_queries(self):
+        resolve_user = async_to_sync(CachedAuthMiddleware(None).resolve_user)
+        user = resolve_user(self.scope(self.session_key))
+        self.assertEqual(user, self.user)
+
+        with self.assertNumQueries(0):
+            cached = resolve_user(self.scope(self.session_key))
+        self.assertIsInstance(cached, CachedUser)
+        self.assertEqual(cached.id, self.user.id)
+
+    def test_invalid_session_is_anonymous(self):
+        user = async_to_sync(CachedAuthMiddleware(None).resolve_user)(self.scope('no-such-session'))
+        self.assertIsInstance(user, AnonymousUser)
+        self.assertEqual(len(user_cache), 0)
+
+    def test_logout_removes_session(self):
+        user_cache.set(self.session_key, CachedUser(self.user.id, self.user.username))
+        self.client.logout()
+        self.assertIsNone(user_cache.get(self.session_key))
+
+    def test_user_save_removes_entries(self):
+        user_cache.set(self.session_key, CachedUser(self.user.id, self.user.username))
+        self.user.set_password('changed')
+        self.user.save()
+        self.assertIsNone(user_cache.get(self.session_key))
+
+    def test_last_login_update_keeps_entries(self):
+        user_cache.set(self.session_key, CachedUser(self.user.id, self.user.username))
+        self.user.last_login = timezone.now()
+        self.user.save(update_fields=['last_login'])
+        self.assertIsNotNone(user_cache.get(self.session_key))
+
+    async def test_chat_consumer_works_with_cached_user(self):
+        application = CachedAuthMiddlewareStack(URLRouter(websocket_urlpatterns))
+        headers = [(b'cookie', f'{settings.SESSION_COOKIE_NAME}={self.session_key}'.encode())]
+        # Первое соединение заполняет кэш, второе получает CachedUser
+        for _ in range(2):
+            communicator = WebsocketCommunicator(application, f'/ws/chat/{self.chat.id}/', headers=headers)
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            await communicator.disconnect()
+        self.assertIsInstance(user_cache.get(self.session_key), CachedUser)
+
+        communicator = WebsocketCommunicator(application, f'/ws/chat/{self.chat.id}/', headers=headers)
+        await communicator.connect()
+        await communicator.send_json_to({'type': 'chat_message', 'text': 'привет'})
+        created = await communicator.receive_json_from()
+        self.assertEqual(created['sender'], 'member')
+
+        await communicator.send_json_to({'type': 'edit_message', 'message_id': created['message_id'], 'new_text': 'пока'})
+        edited = await communicator.receive_json_from()
+        self.assertEqual(edited['new_text'], 'пока')
+        await communicator.disconnect()
+
+        history = await MessageEditHistory.objects.aget(message_id=created['message_id'])
+        self.assertEqual(history.edited_by_id, self.user.id)
+        self.assertEqual(history.old_text, 'привет')
+
+
+@override_settings(CACHES=LOCMEM_CACHES, CHANNEL_LAYERS=LOCAL_CHANNEL_LAYERS)
+class ChatDeletionTests(TestCase):
+    """
+    Удаление чата: скрытие, права, уведомление соединений и окончательная очистка.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user('admin')
+        cls.member = User.objects.create_user('member')
+        cls.group = Chat.objects.create(name='group', is_group=True, admin=cls.admin)
+        cls.group.members.add(cls.admin, cls.member)
+        cls.direct = Chat.objects.create(name='direct')
+        cls.direct.members.add(cls.admin, cls.member)
+
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media_root.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=self.media_root.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+    def delete(self, user, chat):
+        self.client.force_login(user)
+        # Воркер chat-purge в тестах не запущен: задача отбрасывается с предупреждением
+        with self.assertLogs('chat.layers', level='WARNING'):
+            return self.client.post(reverse('delete_chat', args=[chat.id]))
+
+    def is_deleted(self, chat):
+        return Chat.all_objects.get(pk=chat.pk).is_deleted
+
+    def test_group_chat_requires_admin(self):
+        self.client.force_login(self.member)
+        response = self.client.post(reverse('delete_chat', args=[self.group.id]))
+        self.assertRedirects(response, reverse('chat_detail', args=[self.group.id]), fetch_redirect_response=False)
+        self.assertFalse(self.is_deleted(self.group))
+
+        self.delete(self.admin, self.group)
+        self.assertTrue(self.is_deleted(self.group))
+        self.assertEqual(Chat.all_objects.get(pk=self.group.pk).deleted_by, self.admin)
+
+    def test_any_member_deletes_direct_chat(self):
+        self.delete(self.member, self.direct)
+        self.assertTrue(self.is_deleted(self.direct))
+
+    def test_non_member_cannot_delete(self):
+        self.client.force_login(User.objects.create_user('stranger'))
+        response = self.client.post(reverse('delete_chat', args=[self.direct.id]))
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(self.is_deleted(self.direct))
+
+    def test_deleted_chat_is_hidden(self):
+        self.delete(self.member, self.direct)
+        self.client.force_login(self.admin)
+
+        response = self.client.get(reverse('chat_list'))
+        self.assertEqual(list(response.context['chats']), [self.group])
+        self.assertEqual(self.client.get(reverse('chat_detail', args=[self.direct.id])).status_code, 404)
+
+    async def test_socket_to_deleted_chat_is_rejected(self):
+        await Chat.all_objects.filter(pk=self.direct.pk).aupdate(is_deleted=True)
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/chat/{self.direct.id}/')
+        communicator.scope['user'] = self.admin
+        await communicator.connect()
+        self.assertEqual(await communicator.receive_output(), {'type': 'websocket.close', 'code': 4003})
+
+    async def test_open_sockets_are_closed_on_delete(self):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/chat/{self.direct.id}/')
+        communicator.scope['user'] = self.admin
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+
+        await sync_to_async(self.delete)(self.member, self.direct)
+
+        event = await communicator.receive_json_from()
+        self.assertEqual(event['type'], 'chat_deleted')
+        self.assertEqual(event['chat_id'], self.direct.id)
+        self.assertEqual(await communicator.receive_output(), {'type': 'websocket.close', 'code': 4010})
+
+    def test_purge_removes_everything_in_batches(self):
+        Chat.all_objects.filter(pk=self.group.pk).update(is_deleted=True)
+        media = []
+        for n in range(5):
+            name = default_storage.save(f'chat_media/purge_{n}.txt', ContentFile(b'data'))
+            media.append(name)
+            message = Message.objects.create(chat=self.group, sender=self.admin, text=f'сообщение {n}', media=name)
+            MessageEditHistory.objects.create(message=message, old_text='старый', edited_by=self.admin)
+        archived_media = default_storage.save('chat_media/archived.txt', ContentFile(b'data'))
+        now = timezone.now()
+        ArchivedMessage.objects.bulk_create([
+            ArchivedMessage(id=1000 + n, chat=self.group, sender=self.admin, text='архив',
+                            media=archived_media if n == 0 else '', created_at=now, updated_at=now)
+            for n in range(3)
+        ])
+
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as queries:
+            purged = purge_chat(self.group.id, batch_size=2)
+
+        self.assertEqual(purged, 8)
+        message_deletes = [q for q in queries.captured_queries if q['sql'].startswith('DELETE FROM "chat_message"')]
+        self.assertEqual(len(message_deletes), 3)
+        self.assertFalse(Chat.all_objects.filter(pk=self.group.pk).exists())
+        self.assertFalse(Message.objects.filter(chat_id=self.group.id).exists())
+        self.assertFalse(MessageEditHistory.objects.exists())
+        self.assertFalse(ArchivedMessage.objects.filter(chat_id=self.group.id).exists())
+        for name in media + [archived_media]:
+            self.assertFalse(default_storage.exists(name), name)
+
+    def test_purge_ignores_chat_that_is_not_deleted(self):
+        Message.objects.create(chat=self.direct, sender=self.admin, text='остаётся')
+        self.assertIsNone(purge_chat(self.direct.id))
+        self.assertTrue(Chat.objects.filter(pk=self.direct.pk).exists())
+        self.assertEqual(Message.objects.filter(chat=self.direct).count(), 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, CHANNEL_LAYERS=LOCAL_CHANNEL_LAYERS)
+class StreamConsumerTests(TestCase):
+    """
+    Подписки мультиплексированного соединения ws/stream/.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('member')
+        cls.other = User.objects.create_user('other')
+        cls.first = Chat.objects.create(name='first', is_group=True, admin=cls.user)
+        cls.second = Chat.objects.create(name='second', is_group=True, admin=cls.user)
+        cls.first.members.add(cls.user)
+        cls.second.members.add(cls.user)
+        cls.foreign = Chat.objects.create(name='foreign')
+        cls.foreign.members.add(cls.other)
+
+    async def connect(self):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/stream/')
+        communicator.scope['user'] = self.user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def subscribe(self, communicator, *chats):
+        await communicator.send_json_to({'type': 'subscribe', 'chat_ids': [chat.id for chat in chats]})
+        return await communicator.receive_json_from()
+
+    async def test_denied_chats_are_reported(self):
+        communicator = await self.connect()
+        response = await self.subscribe(communicator, self.first, self.foreign)
+        self.assertEqual(response, {'type': 'subscribed', 'chat_ids': [self.first.id],
+                                    'denied': [self.foreign.id], 'failed': []})
+        await communicator.disconnect()
+
+    async def test_subscription_limit(self):
+        communicator = await self.connect()
+        with self.settings(CHAT_STREAM_MAX_SUBSCRIPTIONS=1):
+            self.assertEqual((await self.subscribe(communicator, self.first, self.second))['type'], 'error')
+            self.assertEqual((await self.subscribe(communicator, self.first))['chat_ids'], [self.first.id])
+            self.assertEqual((await self.subscribe(communicator, self.second))['type'], 'error')
+        await communicator.disconnect()
+
+    async def test_actions_require_subscription(self):
+        communicator = await self.connect()
+        await self.subscribe(communicator, self.first)
+
+        await communicator.send_json_to({'type': 'chat_message', 'chat_id': self.second.id, 'text': 'привет'})
+        response = await communicator.receive_json_from()
+        self.assertEqual(response['type'], 'error')
+        self.assertFalse(await Message.objects.filter(chat=self.second).aexists())
+        await communicator.disconnect()
+
+    async def test_events_carry_chat_id_until_unsubscribe(self):
+        communicator = await self.connect()
+        await self.subscribe(communicator, self.first, self.second)
+
+        await communicator.send_json_to({'type': 'chat_message', 'chat_id': self.second.id, 'text': 'привет'})
+        event = await communicator.receive_json_from()
+        self.assertEqual((event['type'], event['chat_id'], event['text']), ('chat_message', self.second.id, 'привет'))
+
+        await communicator.send_json_to({'type': 'unsubscribe', 'chat_ids': [self.second.id]})
+        self.assertEqual(await communicator.receive_json_from(), {'type': 'unsubscribed', 'chat_ids': [self.second.id]})
+        await get_channel_layer().group_send(f'chat_{self.second.id}', {'type': 'chat_message', 'chat_id': self.second.id})
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+    async def test_chat_deleted_drops_only_that_subscription(self):
+        communicator = await self.connect()
+        await self.subscribe(communicator, self.first, self.second)
+        layer = get_channel_layer()
+
+        await layer.group_send(f'chat_{self.first.id}', {'type': 'chat_deleted', 'chat_id': self.first.id})
+        self.assertEqual((await communicator.receive_json_from())['type'], 'chat_deleted')
+
+        await layer.group_send(f'chat_{self.first.id}', {'type': 'chat_message', 'chat_id': self.first.id})
+        self.assertTrue(await communicator.receive_nothing())
+        await layer.group_send(f'chat_{self.second.id}', {'type': 'chat_message', 'chat_id': self.second.id})
+        self.assertEqual((await communicator.receive_json_from())['chat_id'], self.second.id)
+        await communicator.disconnect()
+
+    async def test_timeout_keeps_completed_subscriptions(self):
+        layer = get_channel_layer()
+        group_add = layer.group_add
+
+        async def slow_group_add(group, channel):
+            if group == f'chat_{self.second.id}':
+                await asyncio.sleep(10)
+            await group_add(group, channel)
+
+        communicator = await self.connect()
+        with mock.patch.object(StreamConsumer, 'subscribe_timeout', 0.05), \
+                mock.patch.object(layer, 'group_add', slow_group_add):
+            response = await self.subscribe(communicator, self.first, self.second)
+
+        self.assertEqual((response['chat_ids'], response['failed']), ([self.first.id], [self.second.id]))
+        self.assertNotIn(f'chat_{self.second.id}', layer.groups)
+        await communicator.send_json_to({'type': 'chat_message', 'chat_id': self.first.id, 'text': 'привет'})
+        self.assertEqual((await communicator.receive_json_from())['chat_id'], self.first.id)
+        await communicator.disconnect()
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class FragmentCacheTests(TestCase):
+    """
+    Кэшированные фрагменты страницы чата обновляются при изменении данных и зависят от роли зрителя.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user('alice')
+        cls.author = User.objects.create_user('bob')
+        cls.viewer = User.objects.create_user('carol')
+        cls.extra = User.objects.create_user('dave')
+        cls.chat = Chat.objects.create(name='group', is_group=True, admin=cls.admin)
+        cls.chat.members.add(cls.admin, cls.author, cls.viewer)
+        cls.message = Message.objects.create(chat=cls.chat, sender=cls.author, text='первая версия')
+
+    def setUp(self):
+        # LocMemCache общий для всех тестов процесса
+        cache.clear()
+
+    def page(self, user):
+        self.client.force_login(user)
+        response = self.client.get(reverse('chat_detail', args=[self.chat.id]))
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def can_edit(self, content):
+        return f'edit-message" data-message-id="{self.message.id}"' in content
+
+    def members(self, user):
+        content = self.page(user)
+        start = content.index('Участники:')
+        return content[start:content.index('</small>', start)].split(':', 1)[1].replace(',', ' ').split()
+
+    def test_roles_get_different_fragments(self):
+        owner = self.page(self.author)
+        admin = self.page(self.admin)
+        viewer = self.page(self.viewer)
+
+        self.assertIn('message sent', owner)
+        self.assertTrue(self.can_edit(owner))
+        self.assertIn('message received', admin)
+        self.assertTrue(self.can_edit(admin))
+        self.assertIn('message received', viewer)
+        self.assertFalse(self.can_edit(viewer))
+
+    def test_edit_replaces_fragment(self):
+        self.assertIn('первая версия', self.page(self.viewer))
+        self.message.text = 'вторая версия'
+        self.message.save()
+
+        content = self.page(self.viewer)
+        self.assertIn('вторая версия', content)
+        self.assertNotIn('первая версия', content)
+
+    def test_deleted_message_disappears(self):
+        self.assertIn('первая версия', self.page(self.viewer))
+        self.message.is_deleted = True
+        self.message.save()
+        self.assertNotIn('первая версия', self.page(self.viewer))
+
+    def test_admin_change_updates_actions(self):
+        self.assertFalse(self.can_edit(self.page(self.viewer)))
+        self.chat.admin = self.viewer
+        self.chat.save()
+        self.assertTrue(self.can_edit(self.page(self.viewer)))
+
+    def test_members_add_and_remove_from_both_sides(self):
+        self.assertEqual(self.members(self.viewer), ['alice', 'bob', 'carol'])
+
+        self.chat.members.add(self.extra)
+        self.assertIn('dave', self.members(self.viewer))
+        self.chat.members.remove(self.extra)
+        self.assertNotIn('dave', self.members(self.viewer))
+
+        self.extra.chats.add(self.chat)
+        self.assertIn('dave', self.members(self.viewer))
+        self.extra.chats.remove(self.chat)
+        self.assertNotIn('dave', self.members(self.viewer))
+
+    def test_members_clear_from_both_sides(self):
+        self.assertIn('bob', self.members(self.viewer))
+        self.author.chats.clear()
+        self.assertNotIn('bob', self.members(self.viewer))
+
+        # После очистки со стороны чата зритель сам не участник, поэтому проверяется версия списка
+        version = get_members_version(self.chat.id)
+        self.chat.members.clear()
+        self.assertNotEqual(get_members_version(self.chat.id), version)
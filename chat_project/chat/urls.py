@@ -14,6 +14,9 @@ urlpatterns = [
     path('', views.chat_list, name='chat_list'),
     path('create/', views.chat_create, name='chat_create'),
     path('<int:chat_id>/', views.chat_detail, name='chat_detail'),
+    path('<int:chat_id>/delete/', views.delete_chat, name='delete_chat'),
+    path('<int:chat_id>/messages/', views.chat_messages, name='chat_messages'),
+    path('<int:chat_id>/export/', views.export_chat, name='export_chat'),
     
     # Поиск пользователей
     path('search/users/', views.search_users, name='search_users'),
@@ -22,4 +25,5 @@ urlpatterns = [
     path('message/<int:message_id>/edit/', views.edit_message, name='edit_message'),
     path('message/<int:message_id>/delete/', views.delete_message, name='delete_message'),
     path('message/<int:message_id>/history/', views.message_history, name='message_history'),
+    path('message/history/', views.message_history_bulk, name='message_history_bulk'),
 ]
\ No newline at end of file
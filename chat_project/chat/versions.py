@@ -0,0 +1,57 @@
+import time
+from datetime import datetime, timezone
+
+from django.core.cache import cache
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+
+from .models import Chat
+
+
+def _get_version(key):
+    """
+    Текущая версия по ключу. Начальное значение берётся от текущего времени,
+    чтобы после вытеснения ключа из кэша не совпасть со старой версией.
+    """
+    version = cache.get(key)
+    if version is None:
+        version = time.time_ns()
+        if not cache.add(key, version, timeout=None):
+            version = cache.get(key, version)
+    return version
+
+
+def _bump_version(key):
+    cache.set(key, time.time_ns(), timeout=None)
+
+
+def get_members_version(chat_id):
+    """
+    Версия состава участников чата.
+    """
+    return _get_version(f'chat:{chat_id}:members_version')
+
+
+def bump_members_version(chat_id):
+    """
+    Смена версии при изменении состава участников; старые фрагменты перестают использоваться.
+    """
+    _bump_version(f'chat:{chat_id}:members_version')
+
+
+def bump_chat_version(chat_id):
+    """
+    Версия содержимого чата хранится в Chat.version: время последнего изменения в секундах,
+    строго возрастающее (max(сейчас, предыдущая + 1)), поэтому ETag меняется после каждого
+    изменения. При нескольких изменениях в секунду версия уходит вперёд часов, и
+    Last-Modified по ней не отдаётся. Запись идёт в той же транзакции, что и изменение,
+    поэтому видна всем процессам.
+    """
+    Chat.all_objects.filter(pk=chat_id).update(version=Greatest(F('version') + 1, Value(int(time.time()))))
+
+
+def version_to_datetime(version):
+    """
+    Версия чата — Unix-время в секундах; для Last-Modified нужна дата.
+    """
+    return datetime.fromtimestamp(version, tz=timezone.utc)
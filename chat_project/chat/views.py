@@ -1,12 +1,79 @@
+import hashlib
+import time
+
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login, logout
 from .models import Chat, Message, MessageEditHistory
 from .forms import RegisterForm, LoginForm, ChatCreateForm, MessageForm
 from django.contrib.auth.models import User
-from django.db.models import Q
-from django.http import JsonResponse
+from django.db.models import Count, Q
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import condition, require_POST
+from asgiref.sync import async_to_sync
+from channels.exceptions import ChannelFull
+from channels.layers import get_channel_layer
+from .archive import get_messages_before
+from .export import aiter_chat_export, iter_chat_export
+from .fragments import get_fragment_cache_timeout, get_viewer_role
+from .history import DEFAULT_BULK_VERSIONS, MAX_BULK_IDS, MAX_BULK_VERSIONS, get_history_summary
+from .purge import PURGE_CHANNEL
+from .versions import get_members_version, version_to_datetime
+
+# Количество сообщений на странице чата, если не задано в settings.CHAT_PAGE_SIZE
+DEFAULT_CHAT_PAGE_SIZE = 50
+
+
+def _chat_version(request, chat_id):
+    """
+    Версия чата для условных GET-запросов или None, если пользователь не участник.
+    Результат запоминается на запросе, чтобы ETag и Last-Modified считались одним обращением.
+    """
+    if not hasattr(request, '_chat_version'):
+        request._chat_version = None
+        if request.user.is_authenticated:
+            request._chat_version = (Chat.objects.filter(id=chat_id, members=request.user)
+                                                 .values_list('version', flat=True)
+                                                 .first())
+    return request._chat_version
+
+def chat_etag(request, chat_id):
+    version = _chat_version(request, chat_id)
+    # Страница зависит от пользователя (роль, кнопки), поэтому он входит в ETag
+    return f'{chat_id}-{request.user.id}-{version}' if version is not None else None
+
+def chat_page_etag(request, chat_id):
+    etag = chat_etag(request, chat_id)
+    if etag is None:
+        return None
+    # В формах страницы есть CSRF-токен: после повторного входа секрет меняется,
+    # и закэшированная страница с прежним токеном получила бы 403 при отправке
+    secret = request.META.get('CSRF_COOKIE', '')
+    return f'{etag}-{hashlib.sha256(secret.encode()).hexdigest()[:16]}'
 
+def chat_last_modified(request, chat_id):
+    version = _chat_version(request, chat_id)
+    # Нулевая версия — чат не менялся с момента появления поля. Версия впереди часов —
+    # в текущую секунду было несколько изменений: дата из будущего запрещена (RFC 9110),
+    # а текущая совпала бы с уже отданной, поэтому остаётся только ETag
+    if not version or version > time.time():
+        return None
+    return version_to_datetime(version)
+
+def message_etag(request, message_id):
+    if not request.user.is_authenticated:
+        return None
+    # Число версий учитывается, чтобы сжатие истории не оставляло устаревших копий у клиента
+    row = (Message.objects.filter(id=message_id, chat__is_deleted=False, chat__members=request.user)
+                          .annotate(edits=Count('edit_history'))
+                          .values_list('updated_at', 'edits')
+                          .first())
+    if row is None:
+        return None
+    updated_at, edits = row
+    return f'{message_id}-{request.user.id}-{updated_at.timestamp()}-{edits}'
 
 def register_view(request):
     """
@@ -73,12 +140,13 @@ def chat_create(request):
     return render(request, 'chat/chat_create.html', {'form': form})
 
 @login_required
+# Только ETag: по одной дате нельзя понять, что на странице устаревший CSRF-токен
+@condition(etag_func=chat_page_etag)
 def chat_detail(request, chat_id):
     """
     Отображение чата и обработка сообщений.
     """
     chat = get_object_or_404(Chat, id=chat_id, members=request.user)
-    messages = Message.objects.filter(chat=chat, is_deleted=False).order_by('created_at')[:50]
     
     if request.method == 'POST':
         form = MessageForm(request.POST, request.FILES)
@@ -91,12 +159,84 @@ def chat_detail(request, chat_id):
     else:
         form = MessageForm()
     
+    page_size = getattr(settings, 'CHAT_PAGE_SIZE', DEFAULT_CHAT_PAGE_SIZE)
+    messages = list(
+        Message.objects.filter(chat=chat, is_deleted=False).select_related('sender').order_by('created_at')[:page_size]
+    )
+    for message in messages:
+        message.chat = chat
+        message.viewer_role = get_viewer_role(message, request.user, chat)
+
     return render(request, 'chat/chat_detail.html', {
         'chat': chat,
         'messages': messages,
         'form': form,
+        'members_version': get_members_version(chat.id),
+        'fragment_cache_timeout': get_fragment_cache_timeout(),
     })
 
+@login_required
+@require_POST
+def delete_chat(request, chat_id):
+    """
+    Удаление чата: чат скрывается сразу, данные удаляются фоновым воркером.
+    """
+    chat = get_object_or_404(Chat, id=chat_id, members=request.user)
+    if chat.is_group and chat.admin != request.user:
+        return redirect('chat_detail', chat_id=chat.id)
+
+    chat.is_deleted = True
+    chat.deleted_by = request.user
+    chat.save(update_fields=['is_deleted', 'deleted_by'])
+
+    # Закрываем открытые соединения и ставим задачу на очистку
+    channel_layer = get_channel_layer()
+    async_to_sync(channel_layer.group_send)(f'chat_{chat.id}', {
+        'type': 'chat_deleted',
+        'chat_id': chat.id,
+        'deleted_by': request.user.username,
+    })
+    try:
+        async_to_sync(channel_layer.send)(PURGE_CHANNEL, {
+            'type': 'purge_chat',
+            'chat_id': chat.id,
+        })
+    except ChannelFull:
+        # Воркер не успевает: чат уже скрыт, данные дочистит purge_deleted_chats
+        pass
+    return redirect('chat_list')
+
+@login_required
+@condition(etag_func=chat_etag, last_modified_func=chat_last_modified)
+def chat_messages(request, chat_id):
+    """
+    Подгрузка более старых сообщений чата (JSON), включая архивные.
+    """
+    chat = get_object_or_404(Chat, id=chat_id, members=request.user)
+    try:
+        before_id = int(request.GET['before']) if request.GET.get('before') else None
+        limit = min(int(request.GET.get('limit', 50)), 200)
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Некорректные параметры'}, status=400)
+
+    messages = get_messages_before(chat, before_id=before_id, limit=max(limit, 1))
+    return JsonResponse({
+        'messages': messages,
+        'next_before': messages[-1]['message_id'] if messages else None,
+    })
+
+@login_required
+def export_chat(request, chat_id):
+    """
+    Потоковая выгрузка чата в формате NDJSON.
+    """
+    chat = get_object_or_404(Chat, id=chat_id, members=request.user)
+    # Под ASGI (daphne) потоково отдаётся только асинхронный итератор, под WSGI — синхронный
+    content = aiter_chat_export(chat) if isinstance(request, ASGIRequest) else iter_chat_export(chat)
+    response = StreamingHttpResponse(content, content_type='application/x-ndjson; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="chat_{chat.id}.ndjson"'
+    return response
+
 @login_required
 def search_users(request):
     """
@@ -121,7 +261,7 @@ def edit_message(request, message_id):
     Редактирование сообщения (AJAX).
     """
     if request.method == 'POST' and request.is_ajax():
-        message = get_object_or_404(Message, id=message_id)
+        message = get_object_or_404(Message, id=message_id, chat__is_deleted=False)
         
         # Проверяем права на редактирование
         if message.sender != request.user and not message.chat.admin == request.user:
@@ -150,7 +290,7 @@ def delete_message(request, message_id):
     Удаление сообщения (AJAX).
     """
     if request.method == 'POST' and request.is_ajax():
-        message = get_object_or_404(Message, id=message_id)
+        message = get_object_or_404(Message, id=message_id, chat__is_deleted=False)
         
         # Проверяем права на удаление
         if message.sender != request.user and not message.chat.admin == request.user:
@@ -166,16 +306,38 @@ def delete_message(request, message_id):
     return JsonResponse({'status': 'error'})
 
 @login_required
+@condition(etag_func=message_etag)
 def message_history(request, message_id):
     """
     Просмотр истории изменений сообщения.
     """
     message = get_object_or_404(Message, id=message_id)
-    if not message.chat.members.filter(id=request.user.id).exists():
+    if message.chat.is_deleted or not message.chat.members.filter(id=request.user.id).exists():
         return redirect('chat_list')
     
-    history = MessageEditHistory.objects.filter(message=message).order_by('-edited_at')
+    history = MessageEditHistory.objects.filter(message=message).select_related('edited_by').order_by('-edited_at')
     return render(request, 'chat/message_history.html', {
         'message': message,
         'history': history,
+        'viewer_role': get_viewer_role(message, request.user, message.chat),
+        'fragment_cache_timeout': get_fragment_cache_timeout(),
+    })
+
+@login_required
+def message_history_bulk(request):
+    """
+    Число правок и последние версии для списка сообщений (JSON), одним запросом.
+    Параметры: ids=1,2,3 и versions=N.
+    """
+    try:
+        message_ids = list(dict.fromkeys(int(value) for value in request.GET.get('ids', '').split(',') if value))
+        versions = min(max(int(request.GET.get('versions', DEFAULT_BULK_VERSIONS)), 1), MAX_BULK_VERSIONS)
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Некорректные параметры'}, status=400)
+    if len(message_ids) > MAX_BULK_IDS:
+        return JsonResponse({'status': 'error', 'message': f'Не больше {MAX_BULK_IDS} сообщений за запрос'}, status=400)
+
+    summary = get_history_summary(request.user, message_ids, versions=versions) if message_ids else {}
+    return JsonResponse({
+        'messages': {str(message_id): entry for message_id, entry in summary.items()},
     })
\ No newline at end of file
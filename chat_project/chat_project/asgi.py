@@ -17,15 +17,16 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chat_project.settings')
 django_application = get_asgi_application()
 
 # Импортируем остальное ПОСЛЕ инициализации Django
-from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
+from channels.routing import ChannelNameRouter, ProtocolTypeRouter, URLRouter
 import chat.routing
+from chat.middleware import CachedAuthMiddlewareStack
 
 application = ProtocolTypeRouter({
     "http": django_application,
-    "websocket": AuthMiddlewareStack(
+    "websocket": CachedAuthMiddlewareStack(
         URLRouter(
             chat.routing.websocket_urlpatterns
         )
     ),
+    "channel": ChannelNameRouter(chat.routing.channel_routes),
 })
\ No newline at end of file
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -129,17 +130,86 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 ASGI_APPLICATION = 'chat_project.asgi.application'
 
 # Настройки Channels
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels_redis.core.RedisChannelLayer',
-        'CONFIG': {
-            "hosts": [('127.0.0.1', 6379)],
+# CHAT_CHANNEL_LAYER=redis (по умолчанию) — RedisChannelLayer.
+# CHAT_CHANNEL_LAYER=local — внутрипроцессный слой без Redis (один процесс, тесты).
+# Если вместе с local задан CHAT_CHANNEL_BROKER (путь к сокету run_channel_broker),
+# трафик между процессами (например, к воркеру chat-purge) идёт через брокер.
+if os.environ.get('CHAT_CHANNEL_LAYER', 'redis') == 'local':
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'chat.layers.LocalChannelLayer',
+            'CONFIG': {
+                'capacity': 100,
+                'expiry': 60,
+            },
         },
-    },
-}
+    }
+    if os.environ.get('CHAT_CHANNEL_BROKER'):
+        CHANNEL_LAYERS['default']['CONFIG']['bridge'] = {
+            'transport': 'chat.layers.UnixSocketTransport',
+            'path': os.environ['CHAT_CHANNEL_BROKER'],
+        }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                "hosts": [('127.0.0.1', 6379)],
+            },
+        },
+    }
+
+# Кэш фрагментов шаблонов и версий состава участников
+# CHAT_CACHE=redis (по умолчанию) — общий для всех процессов Redis (отдельная база 1).
+#   Размер ограничивается на стороне Redis: maxmemory и maxmemory-policy allkeys-lru.
+# CHAT_CACHE=local — кэш в памяти процесса (один процесс, тесты); при нескольких
+#   процессах daphne фрагмент списка участников в других процессах обновится только по таймауту.
+if os.environ.get('CHAT_CACHE', 'redis') == 'local':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {
+                # Страница из 200 сообщений — до 200 фрагментов на каждую роль зрителя
+                'MAX_ENTRIES': 100000,
+                # При переполнении вытесняется 1/10 записей, а не треть
+                'CULL_FREQUENCY': 10,
+            },
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('CHAT_CACHE_URL', 'redis://127.0.0.1:6379/1'),
+        },
+    }
 
 LOGIN_URL = 'accounts/login/'
 
 LOGIN_REDIRECT_URL = '/chats/'
 
-LOGOUT_REDIRECT_URL = 'accounts/login/'
\ No newline at end of file
+LOGOUT_REDIRECT_URL = 'accounts/login/'
+
+# Архивация сообщений (команда archive_messages)
+# Сообщения старше этого срока переносятся в архив, если у чата не задан свой срок
+CHAT_ARCHIVE_AFTER_DAYS = 365
+
+# Через сколько дней мягко удалённые сообщения удаляются окончательно
+CHAT_PURGE_DELETED_AFTER_DAYS = 30
+
+# Кэш пользователей WebSocket-соединений (chat.middleware.CachedAuthMiddleware)
+CHAT_WS_AUTH_CACHE_SIZE = 10000
+CHAT_WS_AUTH_CACHE_TTL = 60  # секунд
+
+# Количество сообщений на странице чата
+CHAT_PAGE_SIZE = 50
+
+# Время жизни кэшированных фрагментов шаблонов чата (в секундах)
+CHAT_FRAGMENT_CACHE_TIMEOUT = 3600
+
+# Максимум чатов, на которые можно подписаться через одно соединение ws/stream/
+CHAT_STREAM_MAX_SUBSCRIPTIONS = 100
+
+# Сколько последних версий истории изменений хранить на сообщение (0 — без ограничения),
+# лишние удаляет python manage.py compact_edit_history
+CHAT_EDIT_HISTORY_MAX_VERSIONS = 50